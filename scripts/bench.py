@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""Benchmark the chart pipeline on synthetic data.
+
+Writes JHU-shaped ``time_series_covid19_{confirmed,deaths}_US.csv`` files
+(one row per county, spread over the states in ``data/us_population.csv``)
+and weekly clinical CSVs to a temporary directory, then runs each pipeline
+stage against them, recording wall time and peak traced memory. Every run
+is appended to ``data/cache/benchmarks/results.jsonl`` together with the
+commit and package versions, and compared with the previous run of the
+same size.
+
+The files always hold county rows; ``--counties`` sets the size, and the
+state-level stages aggregate them to at most one entity per state.
+
+    python scripts/bench.py [--counties N] [--days N] [--stages ...]
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = ROOT.joinpath('data', 'cache', 'benchmarks', 'results.jsonl')
+
+
+def synthetic_jhu(folder, counties=3300, days=1000, seed=0):
+    """Write wide US confirmed/deaths files in the JHU layout."""
+    rng = np.random.default_rng(seed)
+    states = pd.read_csv(ROOT.joinpath('data', 'us_population.csv')).state
+    st = np.arange(counties) % len(states)
+    fips = (st + 1) * 1000 + np.arange(counties) // len(states) + 1
+    meta = pd.DataFrame({
+        'UID': 84000000 + fips, 'iso2': 'US', 'iso3': 'USA', 'code3': 840,
+        'FIPS': fips.astype(float),
+        'Admin2': [f'County {n}' for n in range(counties)],
+        'Province_State': states.values[st], 'Country_Region': 'US',
+        'Lat': rng.uniform(25, 49, counties),
+        'Long_': rng.uniform(-124, -67, counties)})
+    meta['Combined_Key'] = meta.Admin2 + ', ' + meta.Province_State + ', US'
+    dates = pd.date_range('2020-01-22', periods=days)
+    cols = [f'{d.month}/{d.day}/{d:%y}' for d in dates]
+
+    # cumulative counts: daily cases from a noisy growth curve, with the
+    # odd negative revision the real files have
+    rate = rng.lognormal(0, 1, (counties, 1)) * \
+        np.exp(np.sin(np.arange(days) / rng.uniform(40, 120, (counties, 1))))
+    daily = rng.poisson(rate)
+    daily[rng.random(daily.shape) < 0.001] *= -1
+    confirmed = np.maximum(np.cumsum(daily, axis=1), 0)
+    deaths = np.minimum(rng.binomial(confirmed, 0.015), confirmed)
+
+    folder = Path(folder)
+    c = pd.concat([meta, pd.DataFrame(confirmed, columns=cols)], axis=1)
+    c.to_csv(folder.joinpath('time_series_covid19_confirmed_US.csv'),
+             index=False)
+    d = pd.concat([meta, pd.DataFrame({'Population': 100000}, index=meta.index),
+                   pd.DataFrame(deaths, columns=cols)], axis=1)
+    d.to_csv(folder.joinpath('time_series_covid19_deaths_US.csv'), index=False)
+
+
+def synthetic_clinical(folder, rows=50000, weeks=20, seed=0):
+    """Write weekly CSVs in the covidclinicaldata layout."""
+    import clinical_data
+    rng = np.random.default_rng(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    n = rows // weeks
+    for w in range(weeks):
+        df = pd.DataFrame({
+            'batch_date': f'2020-{4 + w // 4:02d}-{1 + 7 * (w % 4):02d}',
+            'test_name': 'SARS-CoV-2, NAA', 'swab_type': 'Nasopharyngeal',
+            'covid19_test_results': rng.choice(['Negative', 'Positive'], n,
+                                               p=[0.9, 0.1])})
+        for c in clinical_data.FLAG_COLS:
+            df[c] = rng.choice(['True', 'False', ''], n, p=[0.2, 0.5, 0.3])
+        for c, (mean, sd) in {'age': (45, 18), 'temperature': (37, 0.6),
+                              'pulse': (80, 12), 'sys': (125, 15),
+                              'dia': (80, 10), 'rr': (16, 2),
+                              'sats': (97, 1.5),
+                              'days_since_symptom_onset': (5, 3)}.items():
+            v = rng.normal(mean, sd, n).round(1)
+            v[rng.random(n) < 0.2] = np.nan
+            df[c] = v
+        df.to_csv(folder.joinpath(f'{df.batch_date[0]}_week{w}.csv'),
+                  index=False)
+
+
+# Stages run in order and share ``ctx``; each returns the rows it produced.
+
+def ingest(ctx):
+    # the state panel, streamed from the Parquet copies as prepare() does
+    import jhu
+    jhu.CACHE_DIR = ctx['tmp'].joinpath('jhu-cache')
+    ctx['panel'] = jhu.load_panel('US', 'Province_State', source=ctx['jhu'])
+    return len(ctx['panel'])
+
+
+def reshape(ctx):
+    ctx['long'] = ctx['panel'].to_long('State')
+    return len(ctx['long'])
+
+
+def county_panel(ctx):
+    # as states.load and cesium_ani.load build it
+    import jhu
+    ctx['counties'] = jhu.load_panel('US', jhu.county_fips,
+                                     ['UID', 'Admin2'], ctx['jhu'],
+                                     dtype=np.int32)
+    return len(ctx['counties'])
+
+
+def enrichment(ctx):
+    import enrich
+    enrich.CACHE_DIR = ctx['tmp'].joinpath('enrich-cache')
+    df = ctx['long']
+    enrich.attach(df, 'State', enrich.state_table(df.State))
+    df['Confirmed per M'] = \
+        (df.Confirmed / (df.population / 1000000)).fillna(0)
+    return len(df)
+
+
+def growth_rate(ctx):
+    from growth import calc_growth_rate
+    ctx['growth'] = calc_growth_rate(ctx['long'], 'State')
+    return len(ctx['growth'])
+
+
+def weekly_change(ctx):
+    import covid_time_analysis_us as us_charts
+    ctx['weekly'] = us_charts.weekly_change_chart(ctx['growth'])
+    return len(ctx['growth'].State.unique())
+
+
+def figure(ctx):
+    import charts
+    import plotly.express as px
+    df = ctx['long']
+    ctx['fig'] = charts.choropleth(
+        df, locationmode='USA-states', locations='state_abbr',
+        color='Confirmed', animation_frame='Date', animation_group='State',
+        hover_name='State', hover_data=df.columns,
+        color_continuous_scale=px.colors.diverging.Portland,
+        projection='albers usa')
+    return len(df)
+
+
+def write_html(ctx):
+    import charts
+    path = ctx['tmp'].joinpath('confirmed_map.html')
+    charts.write_html(ctx['fig'], path)
+    return sum(p.stat().st_size for p in ctx['tmp'].glob('confirmed_map*'))
+
+
+def mp4(ctx):
+    # needs geopandas and ffmpeg; counties are drawn as a grid of squares
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    import buildcache
+    import states
+    from shapely.geometry import box
+    plt.rcParams['animation.ffmpeg_path'] = 'ffmpeg'
+    buildcache.ENABLED = False
+    panel = ctx['counties']
+    cids = panel.entities[panel.entities // 1000 == 1]
+    counties = gpd.GeoDataFrame(
+        {'STATE': '01',
+         'geometry': [box(i % 10, i // 10, i % 10 + 1, i // 10 + 1)
+                      for i in range(len(cids))]}, index=cids)
+    panel = panel.take(cids).between(stop=panel.dates[ctx['mp4_days'] - 1])
+    st_map = gpd.GeoDataFrame({'STATE': ['01'],
+                               'geometry': [box(0, 0, 10, 10)]})
+    # render_state writes to ../figures
+    work = ctx['tmp'].joinpath('work')
+    work.mkdir(exist_ok=True)
+    ctx['tmp'].joinpath('figures').mkdir(exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        states.render_state('01', counties, panel, st_map)
+    finally:
+        os.chdir(cwd)
+    return len(panel.dates)
+
+
+def clinical(ctx):
+    import clinical_data
+    import clinical_stats
+    clinical_data.CACHE_DIR = ctx['tmp'].joinpath('clinical-cache')
+    df = clinical_data.load(ctx['clinical'])
+    m = clinical_stats.symptom_matrix(df, clinical_data.FLAG_COLS)
+    clinical_stats.grouped_corr(m, df.covid19_test_results,
+                                clinical_data.FLAG_COLS)
+    return len(df)
+
+
+STAGES = [ingest, reshape, county_panel, enrichment, growth_rate,
+          weekly_change, figure, write_html, mp4, clinical]
+
+
+def measure(func, ctx):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = func(ctx)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'stage': func.__name__, 'seconds': round(seconds, 3),
+            'peak_mb': round(peak / 2 ** 20, 1), 'rows': rows}
+
+
+def _versions():
+    import numpy
+    out = {'python': sys.version.split()[0], 'numpy': numpy.__version__,
+           'pandas': pd.__version__}
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=ROOT, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout
+        out['commit'] = commit.decode().strip()
+    except OSError:
+        pass
+    return out
+
+
+def compare(run):
+    """Print the stages of ``run`` next to the last run of the same size."""
+    previous = None
+    if RESULTS.exists():
+        with open(RESULTS) as f:
+            for line in f:
+                r = json.loads(line)
+                if r['params'] == run['params']:
+                    previous = r
+    before = {s['stage']: s for s in previous['stages']} if previous else {}
+    print(f'{"stage":<14}{"seconds":>9}{"peak MB":>9}'
+          + (f'  vs {previous["versions"].get("commit", "?")}'
+             if previous else ''))
+    for s in run['stages']:
+        line = f'{s["stage"]:<14}'
+        if 'error' in s:
+            print(line + f'  skipped: {s["error"]}')
+            continue
+        line += f'{s["seconds"]:>9.2f}{s["peak_mb"]:>9.1f}'
+        old = before.get(s['stage'])
+        if old and old.get('seconds'):
+            line += f'  {s["seconds"] / old["seconds"] - 1:+.0%} time, ' \
+                    f'{s["peak_mb"] - old["peak_mb"]:+.1f} MB'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counties', type=int, default=3300,
+                        help='rows in the JHU files (default: 3300)')
+    parser.add_argument('--days', type=int, default=1000,
+                        help='date columns (default: 1000)')
+    parser.add_argument('--clinical-rows', type=int, default=50000)
+    parser.add_argument('--mp4-days', type=int, default=30,
+                        help='frames rendered by the mp4 stage')
+    parser.add_argument('--stages', nargs='+',
+                        choices=[s.__name__ for s in STAGES],
+                        help='stages to run (default: all; a stage runs '
+                             'the stages it depends on first)')
+    parser.add_argument('--no-save', action='store_true',
+                        help='do not append the run to the results file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    wanted = set(args.stages or [s.__name__ for s in STAGES])
+    last = max(i for i, s in enumerate(STAGES) if s.__name__ in wanted)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        ctx = {'tmp': tmp, 'jhu': str(tmp.joinpath('jhu')),
+               'clinical': tmp.joinpath('clinical'),
+               'mp4_days': args.mp4_days}
+        tmp.joinpath('jhu').mkdir()
+        synthetic_jhu(ctx['jhu'], args.counties, args.days)
+        if 'clinical' in wanted:
+            synthetic_clinical(ctx['clinical'], args.clinical_rows)
+
+        stages = list()
+        for func in STAGES[:last + 1]:
+            if func in (mp4, clinical) and func.__name__ not in wanted:
+                continue
+            try:
+                result = measure(func, ctx)
+            except Exception as e:
+                # missing optional packages, ffmpeg, or an earlier failure
+                tracemalloc.stop()
+                result = {'stage': func.__name__,
+                          'error': f'{type(e).__name__}: {e}'}
+            if func.__name__ in wanted:
+                stages.append(result)
+
+    run = {'time': datetime.now().isoformat(timespec='seconds'),
+           'params': {'counties': args.counties, 'days': args.days,
+                      'clinical_rows': args.clinical_rows,
+                      'mp4_days': args.mp4_days},
+           'versions': _versions(), 'stages': stages}
+    compare(run)
+    if not args.no_save:
+        RESULTS.parent.mkdir(parents=True, exist_ok=True)
+        with open(RESULTS, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Nightly chart build.
+
+Every chart is a task with explicit inputs. The shared US and global
+panels are prepared once, stored as Parquet under ``data/cache/build`` and
+read by the chart tasks, which run in a process pool as soon as their
+inputs exist; a chart whose inputs and code are unchanged is restored from
+the build cache instead (see ``buildcache``). ``index.html`` is generated
+last and the wall time of every task is reported at the end. With
+``INSTRUMENT=1`` every task and the stages inside it are also measured and
+saved as one JSON run report (see ``instrument``).
+
+    python scripts/build.py [--workers N]
+"""
+import argparse
+import importlib
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import pandas as pd
+
+import buildcache
+import charts
+import gen_index
+import instrument
+
+ROOT = Path(__file__).resolve().parent.parent
+BUILD_DIR = ROOT.joinpath('data', 'cache', 'build')
+
+# ``func`` is 'module:function'; ``args`` are '<dataset>.<frame>' references
+# to prepared frames; ``outputs`` names the frames a dataset task returns.
+Task = namedtuple('Task', ['name', 'func', 'deps', 'args', 'outputs'])
+
+DATASETS = {'us': 'covid_time_analysis_us',
+            'global': 'covid_time_analysis_global'}
+
+
+def tasks():
+    out = list()
+    charts = list()
+    for dataset, module in DATASETS.items():
+        mod = importlib.import_module(module)
+        out.append(Task(dataset, f'{module}:prepare', [], [], mod.FRAMES))
+        for name, (func, source) in mod.CHARTS.items():
+            args = [f'{dataset}.{source}'] if source else []
+            out.append(Task(name, f'{module}:{func.__name__}',
+                            [dataset] if source else [], args, []))
+            charts.append(name)
+    out.append(Task('index', 'gen_index:build_index', charts, [], []))
+    return out
+
+
+def run(task):
+    """Run one task in a worker.
+
+    Returns (wall seconds, data date or None, whether the output was reused
+    from the build cache, instrumentation records). The data date is the
+    latest ``Date``/``date`` in the task's input frames. Chart tasks are
+    skipped when their input frames, module source and chart settings hash
+    to the key of a previous run.
+    """
+    start = time.perf_counter()
+    module, func = task.func.split(':')
+    mod = importlib.import_module(module)
+    with instrument.stage(task.name) as s:
+        args = [pd.read_parquet(BUILD_DIR.joinpath(f'{a}.parquet'))
+                for a in task.args]
+        s['rows_in'] = sum(len(df) for df in args) if args else None
+        dates = [str(df[c].max()) for df in args for c in ('Date', 'date')
+                 if c in df]
+        data_date = max(dates) if dates else None
+
+        chart = task.args and not task.outputs
+        reused = False
+        if chart:
+            key = buildcache.key(task.func, Path(mod.__file__),
+                                 Path(charts.__file__), charts.LAZY, *args)
+            reused = buildcache.restore(task.name, key)
+        if not reused:
+            result = getattr(mod, func)(*args)
+            s['outputs'] = gen_index.outputs(task.name)
+            for frame, df in zip(task.outputs, result or []):
+                path = BUILD_DIR.joinpath(f'{task.name}.{frame}.parquet')
+                df.to_parquet(path)
+                s['outputs'].append(path)
+            if task.outputs:
+                s['rows_out'] = sum(len(df) for df in result)
+        if chart and not reused:
+            buildcache.store(task.name, key, gen_index.outputs(task.name))
+    return time.perf_counter() - start, data_date, reused, instrument.records()
+
+
+def build(tasks, workers=None):
+    """Run ``tasks`` in dependency order.
+
+    Returns ({name: seconds or None}, instrumentation records). Tasks that
+    wrote ``charts/<name>.html`` are recorded in the manifest.
+    """
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    pending = {t.name: t for t in tasks}
+    times, failed, stages = dict(), set(), list()
+    with ProcessPoolExecutor(workers) as pool:
+        running = dict()
+        while pending or running:
+            for t in list(pending.values()):
+                if failed.intersection(t.deps):
+                    logging.error(f'Skipping {t.name}: an input failed.')
+                    failed.add(t.name)
+                    times[t.name] = None
+                    del pending[t.name]
+                elif all(d in times for d in t.deps):
+                    running[pool.submit(run, t)] = t.name
+                    del pending[t.name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in finished:
+                name = running.pop(f)
+                try:
+                    times[name], data_date, reused, records = f.result()
+                    stages.extend(dict(r, reused=reused) for r in records)
+                    logging.info(f'{name} done in {times[name]:.1f}s.')
+                    if gen_index.outputs(name):
+                        # keep the recorded build time of reused charts
+                        gen_index.record(name, None if reused
+                                         else times[name], data_date)
+                except Exception:
+                    logging.exception(f'{name} failed.')
+                    failed.add(name)
+                    times[name] = None
+    return times, stages
+
+
+def report(times, wall):
+    width = max(len(n) for n in times)
+    print(f'{"task":<{width}}  seconds')
+    for name, sec in times.items():
+        print(f'{name:<{width}}  ' + ('failed' if sec is None else f'{sec:7.1f}'))
+    busy = sum(s for s in times.values() if s)
+    print(f'{"wall":<{width}}  {wall:7.1f}  (task total {busy:.1f})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='process pool size (default: CPU count)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(message)s',
+                        datefmt='%d-%b-%y %H:%M:%S')
+    os.chdir(ROOT)
+    start = time.perf_counter()
+    times, stages = build(tasks(), args.workers)
+    wall = time.perf_counter() - start
+    report(times, wall)
+    if instrument.ENABLED:
+        path = instrument.write_report(
+            stages, wall=round(wall, 3),
+            failed=[n for n, s in times.items() if s is None])
+        logging.info(f'Run report written to {path}.')
+    if any(s is None for s in times.values()):
+        raise SystemExit(1)
@@ -0,0 +1,93 @@
+"""Skip-if-unchanged cache for generated charts and animations.
+
+A build step hashes what its output depends on (the data slice it plots,
+the source of the code that draws it and any parameters) with ``key``. If
+``restore`` finds the same key from an earlier run, the cached copies of
+the outputs are put back in place and the step is skipped; otherwise the
+step runs and ``store`` keeps its outputs under ``data/cache/build/outputs``.
+Set ``BUILD_CACHE=0`` to rebuild everything.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT.joinpath('data', 'cache', 'build', 'outputs')
+ENABLED = os.environ.get('BUILD_CACHE', '1') != '0'
+
+
+def _update(h, part):
+    if isinstance(part, (pd.DataFrame, pd.Series, pd.Index)):
+        cols = part.columns if isinstance(part, pd.DataFrame) else [part.name]
+        h.update(repr(list(cols)).encode())
+        h.update(pd.util.hash_pandas_object(part, index=False).values.tobytes())
+    elif isinstance(part, np.ndarray):
+        h.update(f'{part.dtype}{part.shape}'.encode())
+        h.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, Path):
+        h.update(part.read_bytes())
+    elif isinstance(part, bytes):
+        h.update(part)
+    elif isinstance(part, (list, tuple)):
+        for p in part:
+            _update(h, p)
+    else:
+        h.update(repr(part).encode())
+
+
+def key(*parts):
+    """Hash of frames, arrays, source files (``Path``), bytes and values."""
+    h = hashlib.sha1()
+    for part in parts:
+        _update(h, part)
+    return h.hexdigest()
+
+
+def _entry(name):
+    return CACHE_DIR.joinpath(name)
+
+
+def restore(name, key):
+    """Put back the cached outputs of ``name`` if stored under ``key``.
+
+    Returns whether the step can be skipped.
+    """
+    entry = _entry(name)
+    if not ENABLED or not entry.joinpath('key.json').exists():
+        return False
+    with open(entry.joinpath('key.json')) as f:
+        stored = json.load(f)
+    if stored['key'] != key:
+        return False
+    files = [Path(p) for p in stored['files']]
+    cached = [entry.joinpath(p.name) for p in files]
+    if not all(c.exists() for c in cached):
+        return False
+    for c, p in zip(cached, files):
+        if not p.exists() or p.read_bytes() != c.read_bytes():
+            p.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(c, p)
+    logging.info(f'{name}: inputs unchanged, reusing cached output.')
+    return True
+
+
+def store(name, key, outputs):
+    """Keep copies of ``outputs`` as the result of ``name`` for ``key``."""
+    if not ENABLED:
+        return
+    entry = _entry(name)
+    if entry.exists():
+        shutil.rmtree(entry)
+    entry.mkdir(parents=True)
+    files = [Path(p) for p in outputs if Path(p).exists()]
+    for p in files:
+        shutil.copyfile(p, entry.joinpath(p.name))
+    with open(entry.joinpath('key.json'), 'w') as f:
+        json.dump({'key': key, 'files': [str(p) for p in files]}, f,
+                  indent=2)
@@ -1,245 +1,262 @@
+import argparse
+import hashlib
 import json
-import random
-import shapely
 import pandas as pd
 import numpy as np
-import geopandas as gpd
 import logging
+import time
 import us
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-from matplotlib.animation import FFMpegWriter
-from matplotlib.dates import DateFormatter, WeekdayLocator, DayLocator, MONDAY
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from datetime import datetime
 from pathlib import Path
 
-plt.rcParams['animation.ffmpeg_path'] = \
-    r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
+import buildcache
+import geometry
+import instrument
+import jhu
 
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(message)s',
-                    datefmt='%d-%b-%y %H:%M:%S')
-
-fp_s = r'..\data\gz_2010_us_040_00_5m\gz_2010_us_040_00_5m.shp'
-fp_c = r'..\data\gz_2010_us_050_00_500k\gz_2010_us_050_00_500k.shp'
-
-logging.info(f'Loading state map data ({fp_s})')
-st_map = gpd.read_file(fp_s)
-
-logging.info(f'Loading county map data ({fp_c})')
-df_map = gpd.read_file(fp_c)
-
-# logging.info(f'Flattening county multipolygon shapes.')
-# df_temp = pd.DataFrame([])
-# for i, v in df_map.iterrows():
-#     if isinstance(v.geometry, shapely.geometry.multipolygon.MultiPolygon):
-#         for p in list(v.geometry):
-#             new_v = v.copy()
-#             new_v.at['geometry'] = p
-#             df_temp = df_temp.append(new_v, ignore_index=True)
-#         df_map.drop(i, inplace=True)
-# df_map = pd.concat([df_map, df_temp])
-# df_map.reset_index(drop=True, inplace=True)
-# del df_temp
-
-# logging.info(f'Converting state map to EPSG 2163.')
-# st_map = st_map.to_crs(epsg=3857)
-logging.info(f'Converting county map to EPSG 4326.')
-df_map = df_map.to_crs(epsg=4326)
-
-us_confirmed_path = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-us_death_path = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
-
-logging.info(f'Loading confirmed cases: {us_confirmed_path}')
-us_c = pd.read_csv(us_confirmed_path)
-logging.info(f'Loaded cases with shape: {us_c.shape}')
-
-logging.info(f'Loading death cases: {us_death_path}')
-us_d = pd.read_csv(us_death_path)
-logging.info(f'Loaded deaths with shape: {us_d.shape}')
-
-logging.info(f'Dropping rows with out county names.')
-us_c.drop(us_c[us_c.Admin2.isna()].index, inplace=True)
-logging.info(f'Cases new shape: {us_c.shape}')
-us_d.drop(us_d[us_d.Admin2.isna()].index, inplace=True)
-logging.info(f'Deaths new shape: {us_d.shape}')
-
-df_map['cid'] = df_map.GEO_ID.apply(lambda x: f'{str(x)[-5:]:0>5}')
-us_c['cid'] = us_c.UID.apply(lambda x: f'{str(x)[-5:]:0>5}')
-us_d['cid'] = us_d.UID.apply(lambda x: f'{str(x)[-5:]:0>5}')
-
-c = us_c.groupby('cid').sum().iloc[:, 5:].unstack().reset_index()
-d = us_d.groupby('cid').sum().iloc[:, 6:].unstack().reset_index()
-cd = pd.merge(c, d, on=['level_0', 'cid'])
-new_names = {'level_0': 'date', '0_x': 'confirmed', '0_y': 'deaths'}
-cd = cd.rename(index=str, columns=new_names)
-cd['date'] = pd.to_datetime(cd['date'])
-
-
-logging.info(f'Dropping rows where cid starts with 70, 80, 88, 90, 99.')
-for i in [70, 80, 88, 90, 99]:
-    idx = cd[cd['cid'].str.startswith(str(i))].index
-    cd.drop(idx, inplace=True)
-
-
-logging.info(f'Adding state names to merged data frames.')
-for row in cd.itertuples():
-    st = row.cid[:2]
-    try:
-        cd.at[row.Index, 'state'] = us.states.lookup(st).name
-    except AttributeError:
-        logging.error(f'AttributeError: Cannot find state name for code: '
-                      f'{row.Index, st}')
-
-cond2 = cd.state == 'Virginia'
-
-co = cd[cond2].copy()
-
-
-def gen_poly_json(x, y, cnty, lsad, map_idx, name, enum=0):
-    red = random.randint(0, 255)
-    green = random.randint(0, 255)
-    blue = random.randint(0, 255)
-    coords = list()
-    for lon, lat in zip(x, y):
-        coords.append(lon)
-        coords.append(lat)
-        coords.append(0)
-    coords_id = '_'.join([cnty, lsad, df_map.at[map_idx, 'STATE'],
-                          'coords', str(enum)])
-    p = f"""
-{{
-  id: "{coords_id}",
-  name: "{name}",
-  polygon: {{
-    positions: {{
-      cartographicDegrees: {coords},
-      }},
-    material: {{
-      solidColor: {{
-        color: {{
-          rgba: [{red}, {green}, {blue}, 150],
-          }},
-        }},
-      }},
-    height: 0,
-    extrudedHeight: 0,
-  }},
-}},
-"""
-    return coords_id, p
-
-
-czml = ''
-all_ids = list()
-
-for cid in co.cid.unique():
-    map_idx = df_map[df_map.cid == cid].index.values[0]
-    county = df_map.at[map_idx, 'NAME']
-    lsad = df_map.at[map_idx, 'LSAD'].lower()
-    cnty = county.replace(' ', '_').lower()
-    state = us.states.lookup(cid[:2]).name
-    co_df = co[co.cid == cid]
-    _id = '_'.join([cnty, lsad, df_map.at[map_idx, 'STATE'], 'cases'])
-    name = ' '.join([county, lsad, state]).title()
-    logging.info(f'Compiling data for: {name}')
-
-    cases = list()
-    for row in co_df.itertuples():
-        cases.append(row.date.isoformat())
-        cases.append(row.confirmed)
-    d = f"""
-  {{
-  id: "{_id}",
-  name: "{name + ' Data'}",
-  properties: {{
-    constant_property: true,
-    cases: {{
-      number: {cases}
-      }},
-    }},
-  }},
-"""
-    czml += d
-    try:
-        x, y = df_map.at[map_idx, 'geometry'].exterior.coords.xy
-        coords_id, p = gen_poly_json(x, y, cnty, lsad, map_idx, name)
-        all_ids.append((_id, coords_id))
-        czml += p
-    except AttributeError:
-        poly = list(df_map.at[map_idx, 'geometry'])
-        for e, i in enumerate(poly):
-            x, y = i.exterior.coords.xy
-            coords_id, p = gen_poly_json(x, y, cnty, lsad, map_idx, name, e + 1)
-            all_ids.append((_id, coords_id))
-            czml += p
-
-start = co.at[co.date.sort_values().index[0], 'date']
-stop = co.at[co.date.sort_values().index[-1], 'date']
-interval = '/'.join([start.isoformat(), stop.isoformat()])
-doc_setup = f"""{{
-    id: "document",
-    name: "CZML Custom Properties",
-    version: "1.0",
-    clock: {{
-        interval: "{interval}",
-        currentTime: "{start.isoformat()}",
-        multiplier: {int((stop - start).total_seconds() / 20)},
-    }},
-}},
-"""
-
-czml = 'var czml = [\n' + doc_setup + czml + '\n];'
-
-# Building JS code
-js_code = """
-function scaleProperty(property, scalingFactor) {
-  return new Cesium.CallbackProperty(function (time, result) {
-    result = property.getValue(time, result);
-    result = result * scalingFactor;
-    return result;
-  }, property.isConstant);
-}
-function updateDescription(property) {
-  // returns a property that scales another property by a constant factor.
-  return new Cesium.CallbackProperty(function (time, result) {
-    result = property.getValue(time, result);
-    result = "<p>Confirmed COVID-19 Cases: "+ Math.ceil(result) + "</p>";
-    return result;
-  }, property.isConstant);
-}
-
-function setExtrudedHeight() {"""
-
-for e, (case_id, coord_id) in enumerate(all_ids):
-    case_vars = f"""
-  var property_{e} = dataSource.entities.getById("{case_id}").properties.cases;
-  var {coord_id} = dataSource.entities.getById("{coord_id}");
-  {coord_id}.polygon.extrudedHeight = scaleProperty(property_{e}, 10);
-  {coord_id}.description = updateDescription(property_{e});
-"""
-    js_code += case_vars
-
-js_code += """}
+# metres of extrusion per confirmed case
+HEIGHT_SCALE = 10
 
+LOADER_JS = """
 var viewer = new Cesium.Viewer("cesiumContainer", {
   shouldAnimate: true,
 });
 
 var dataSource = new Cesium.CzmlDataSource();
 
-
-dataSource.load(czml);
+dataSource.load("%(src)s");
 viewer.dataSources.add(dataSource);
 viewer.zoomTo(dataSource);
 viewer.scene.debugShowFramesPerSecond = true;
-setExtrudedHeight();
 """
 
-js_code = czml + js_code
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(message)s',
+                    datefmt='%d-%b-%y %H:%M:%S')
+
 
-with open('virginia.js', 'w') as f:
-    f.write(js_code)
-logging.info('Done.')
+def load(states=None, level='medium'):
+    """County shapes and counts; return (shapes, panel, state names).
+
+    Counties are keyed by integer FIPS code: ``shapes`` is indexed by it,
+    ``panel`` has one row per county and the state names are a Series on
+    the same index. ``states`` optionally restricts the counties to a list
+    of state names and ``level`` is the ``geometry.LEVELS`` key of the
+    shapes ('full' keeps every vertex of the 500k shapefile).
+    """
+    with instrument.stage('shapes') as s:
+        logging.info(f'Loading {level} county map data in EPSG 4326.')
+        df_map = geometry.simplified(geometry.COUNTY_SHAPES, 4326, level)
+        shapes = df_map.set_index(df_map.fips.astype(int))
+        s['rows_out'] = len(shapes)
+
+    with instrument.stage('panel') as s:
+        logging.info(f'Loading confirmed cases and deaths by county.')
+        panel = jhu.load_panel('US', jhu.county_fips, ['UID', 'Admin2'],
+                               dtype=np.int32)
+        logging.info(f'Loaded {panel}')
+        s['rows_out'] = len(panel)
+
+    cids = panel.entities.to_series(index=panel.entities)
+    codes = cids // 1000
+    logging.info(f'Dropping counties with state codes 70, 80, 88, 90, 99.')
+    keep = ~codes.isin([70, 80, 88, 90, 99])
+
+    names = dict()
+    for code in codes[keep].unique():
+        st = us.states.lookup(f'{code:02d}')
+        if st is None:
+            logging.error(f'Cannot find state name for code: {code:02d}')
+        names[code] = getattr(st, 'name', None)
+    state = codes.map(names)
+    keep &= state.notna()
+    if states is not None:
+        keep &= state.isin(states)
+    panel = panel.take(cids[keep].values)
+    return shapes, panel, state[keep]
+
+
+def color(cid):
+    """Fixed RGBA for a county, derived from its FIPS code."""
+    red, green, blue = hashlib.md5(f'{cid:05d}'.encode()).digest()[:3]
+    return [red, green, blue, 150]
+
+
+def sampled(epoch, offsets, values, drop_unchanged=True):
+    """Epoch-relative CZML samples of ``values`` at ``offsets`` seconds.
+
+    With ``drop_unchanged`` only the first and last sample of each run of
+    equal values are kept; Cesium's linear interpolation fills the rest.
+    """
+    keep = np.ones(len(values), dtype=bool)
+    if drop_unchanged and len(values) > 2:
+        same = values[1:] == values[:-1]
+        keep[1:-1] = ~(same[:-1] & same[1:])
+    return {'epoch': epoch,
+            'number': np.column_stack([offsets[keep],
+                                       values[keep]]).ravel().tolist()}
+
+
+def described(dates, values):
+    """Description intervals, one per run of equal ``values``."""
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    bounds = [dates[i] for i in starts] + [dates[-1]]
+    return [{'interval': f'{a}/{b}',
+             'string': f'<p>Confirmed COVID-19 Cases: {v}</p>'}
+            for a, b, v in zip(bounds[:-1], bounds[1:],
+                               values[starts].tolist())]
+
+
+def gen_poly_packet(x, y, cnty, lsad, st, cid, name, height, description,
+                    enum=0):
+    coords = list()
+    for lon, lat in zip(x, y):
+        coords.append(lon)
+        coords.append(lat)
+        coords.append(0)
+    coords_id = '_'.join([cnty, lsad, st, 'coords', str(enum)])
+    return {
+        'id': coords_id,
+        'name': name,
+        'description': description,
+        'polygon': {
+            'positions': {'cartographicDegrees': coords},
+            'material': {'solidColor': {'color': {'rgba': color(cid)}}},
+            'height': 0,
+            'extrudedHeight': height,
+            },
+        }
+
+
+def packets(shapes, panel, state, drop_unchanged=True):
+    """Yield the CZML packets for the counties of ``panel``.
+
+    Extrusion height and description are written as time-dynamic
+    properties, so the viewer needs no per-entity callbacks.
+    """
+    start = panel.dates[0]
+    stop = panel.dates[-1]
+    interval = '/'.join([start.isoformat(), stop.isoformat()])
+    yield {
+        'id': 'document',
+        'name': 'CZML Custom Properties',
+        'version': '1.0',
+        'clock': {
+            'interval': interval,
+            'currentTime': start.isoformat(),
+            'multiplier': int((stop - start).total_seconds() / 20),
+            },
+        }
+
+    epoch = start.isoformat()
+    offsets = ((panel.dates - start) // pd.Timedelta(seconds=1)).values
+    # the last interval runs to the end of the last day
+    dates = [d.isoformat() for d in panel.dates] + \
+        [(stop + pd.Timedelta(days=1)).isoformat()]
+    rows = shapes.reindex(panel.entities)
+    for cid, shape, confirmed in zip(panel.entities, rows.itertuples(),
+                                     panel.confirmed):
+        if pd.isna(shape.NAME):
+            logging.warning(f'No county shape for {cid:05d}, skipping.')
+            continue
+        county = shape.NAME
+        lsad = shape.LSAD.lower()
+        st = shape.STATE
+        cnty = county.replace(' ', '_').lower()
+        name = ' '.join([county, lsad, state[cid]]).title()
+        logging.debug(f'Compiling data for: {name}')
+
+        height = sampled(epoch, offsets, confirmed * HEIGHT_SCALE,
+                         drop_unchanged)
+        description = described(dates, confirmed)
+        geom = shape.geometry
+        for e, poly in enumerate(getattr(geom, 'geoms', [geom])):
+            x, y = poly.exterior.coords.xy
+            yield gen_poly_packet(x, y, cnty, lsad, st, cid, name, height,
+                                  description,
+                                  e + 1 if hasattr(geom, 'geoms') else 0)
+
+
+def write_czml(path, packets):
+    """Stream ``packets`` to ``path`` as a CZML (JSON array) document."""
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for n, packet in enumerate(packets):
+            if n:
+                f.write(',\n')
+            json.dump(packet, f, separators=(',', ':'))
+        f.write('\n]\n')
+
+
+def write_js(path, czml_name):
+    with open(path, 'w') as f:
+        f.write(LOADER_JS % {'src': czml_name})
+
+
+def write(shapes, panel, state, out, stem, drop_unchanged=True,
+          level='medium'):
+    czml = out.joinpath(f'{stem}.czml')
+    js = out.joinpath(f'{stem}.js')
+    with instrument.stage(f'write-{stem}', rows_in=len(panel)) as s:
+        s['outputs'] = [czml, js]
+        rows = shapes.reindex(panel.entities)
+        key = buildcache.key(Path(__file__), stem, drop_unchanged, level,
+                             panel.dates, panel.entities, panel.confirmed,
+                             state, rows.drop(columns='geometry').astype(str),
+                             [getattr(g, 'wkb', b'') for g in rows.geometry])
+        if buildcache.restore(f'czml-{stem}', key):
+            return
+        logging.info(f'Writing {czml} ({len(panel)} counties).')
+        write_czml(czml, packets(shapes, panel, state, drop_unchanged))
+        write_js(js, czml.name)
+        buildcache.store(f'czml-{stem}', key, [czml, js])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write county case extrusions as CZML for Cesium.')
+    parser.add_argument('--states', nargs='+', metavar='STATE',
+                        help='state names, abbreviations or FIPS codes '
+                             '(default: all)')
+    parser.add_argument('--per-state', action='store_true',
+                        help='write one CZML/JS pair per state')
+    parser.add_argument('--all-samples', action='store_true',
+                        help='keep every daily sample, including days on '
+                             'which the count did not change')
+    parser.add_argument('--level', default='medium',
+                        choices=list(geometry.LEVELS),
+                        help='county shape simplification (default: medium)')
+    parser.add_argument('--out', default='.', type=Path,
+                        help='output directory (default: current)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    states = None
+    if args.states:
+        states = list()
+        for s in args.states:
+            st = us.states.lookup(s)
+            if st is None:
+                parser.error(f'unknown state: {s}')
+            states.append(st.name)
+    shapes, panel, state = load(states, args.level)
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    if args.per_state:
+        for name, cids in state.groupby(state, sort=True):
+            write(shapes, panel.take(cids.index), state, args.out,
+                  name.lower().replace(' ', '_'), not args.all_samples,
+                  args.level)
+    else:
+        write(shapes, panel, state, args.out, 'us_counties',
+              not args.all_samples, args.level)
+    if instrument.ENABLED:
+        path = instrument.write_report(
+            instrument.records(), 'cesium',
+            wall=round(time.perf_counter() - start, 3))
+        logging.info(f'Run report written to {path}.')
+    logging.info('Done.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Compact writer for the animated choropleth charts.
+
+``px.choropleth(..., animation_frame=...)`` embeds a full trace, including
+every ``hover_data`` column, for each frame in the HTML file. With
+``LAZY_CHARTS=1`` the scripts instead write a single-frame base figure and
+a columnar ``<chart>.frames.json`` side file next to it: locations and
+hover names are stored once and each frame only carries its color values
+and hover columns. The page fetches the side file after the map is drawn
+and adds the frames, slider and play buttons from it.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+LAZY = os.environ.get('LAZY_CHARTS', '0') == '1'
+
+LOADER_JS = """
+var gd = document.getElementById('{plot_id}');
+fetch('%(src)s').then(function (r) { return r.json(); }).then(function (data) {
+  var cols = Object.keys(data.hover);
+  var frames = data.frames.map(function (name, i) {
+    var custom = data.z[i].map(function (_, j) {
+      return cols.map(function (c) { return data.hover[c][i][j]; });
+    });
+    return {name: name, traces: [0], data: [{z: data.z[i], customdata: custom}]};
+  });
+  var still = {mode: 'immediate', frame: {duration: 0, redraw: true},
+               transition: {duration: 0}};
+  var steps = data.frames.map(function (name) {
+    return {label: name, method: 'animate', args: [[name], still]};
+  });
+  Plotly.addFrames(gd, frames).then(function () {
+    Plotly.relayout(gd, {
+      sliders: [{active: 0, steps: steps, x: 0.1, len: 0.9,
+                 pad: {b: 10, t: 60}, currentvalue: {prefix: '%(label)s='}}],
+      updatemenus: [{type: 'buttons', direction: 'left', showactive: false,
+                     x: 0.1, xanchor: 'right', y: 0, yanchor: 'top',
+                     pad: {r: 10, t: 70}, buttons: [
+        {label: '&#9654;', method: 'animate',
+         args: [null, {frame: {duration: 500, redraw: true},
+                       fromcurrent: true, transition: {duration: 500}}]},
+        {label: '&#9724;', method: 'animate', args: [[null], still]}]}]
+    });
+  });
+});
+"""
+
+
+def _matrix(df, frames, entities, key, frame, column):
+    m = df.pivot(index=frame, columns=key, values=column) \
+        .reindex(index=frames, columns=entities)
+    return np.where(pd.isna(m), None, m.astype(object)).tolist()
+
+
+def choropleth(data_frame, animation_frame=None, animation_group=None,
+               hover_data=None, **kwargs):
+    """Drop-in for ``px.choropleth`` that defers frames when ``LAZY``.
+
+    Returns the usual animated figure unless lazy charts are on; then the
+    figure shows the first frame and carries the frame data for
+    ``write_html``.
+    """
+    if not LAZY or animation_frame is None:
+        return px.choropleth(data_frame, animation_frame=animation_frame,
+                             animation_group=animation_group,
+                             hover_data=hover_data, **kwargs)
+
+    df = data_frame
+    color = kwargs['color']
+    hover_name = kwargs.get('hover_name')
+    key = animation_group or kwargs['locations']
+    frames = list(pd.unique(df[animation_frame]))
+    entities = list(pd.unique(df[key]))
+    first = df.drop_duplicates(key).set_index(key, drop=False)
+    cols = [c for c in (hover_data if hover_data is not None else [])
+            if c not in (hover_name, color)]
+
+    z = _matrix(df, frames, entities, key, animation_frame, color)
+    hover = {c: _matrix(df, frames, entities, key, animation_frame, c)
+             for c in cols}
+    fig = px.choropleth(df[df[animation_frame] == frames[0]], **kwargs)
+    template = '<b>%{hovertext}</b><br><br>' if hover_name else ''
+    template += ''.join(f'{c}=%{{customdata[{i}]}}<br>'
+                        for i, c in enumerate(cols))
+    template += f'{color}=%{{z}}<extra></extra>'
+    fig.update_traces(
+        locations=first[kwargs['locations']].tolist(),
+        hovertext=first[hover_name].tolist() if hover_name else None,
+        z=z[0],
+        customdata=[list(r) for r in zip(*(hover[c][0] for c in cols))]
+        if cols else None, hovertemplate=template)
+    fig._frame_label = animation_frame
+    fig._frame_data = {'frames': [str(f) for f in frames], 'z': z,
+                       'hover': hover}
+    return fig
+
+
+def write_html(fig, path):
+    """``fig.write_html`` with the frame side file for lazy figures."""
+    data = getattr(fig, '_frame_data', None)
+    if data is None:
+        fig.write_html(path)
+        return
+    path = Path(path)
+    src = path.with_suffix('.frames.json')
+    with open(src, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    fig.write_html(path, include_plotlyjs='cdn',
+                   post_script=LOADER_JS % {'src': src.name,
+                                            'label': fig._frame_label})
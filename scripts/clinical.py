@@ -3,24 +3,39 @@ import numpy as np
 import us
 import os
 import subprocess
+import time
 from pathlib import Path
 import plotly.express as px
 
+import buildcache
+import clinical_data
+import clinical_stats
+import instrument
+
+start = time.perf_counter()
 os.chdir('../data')
 # cmd = ['git', 'pull', 'https://github.com/mdcollab/covidclinicaldata.git']
-cmd = ['git', 'submodule,' 'update', '--remote', '--merge']
+cmd = ['git', 'submodule', 'update', '--remote', '--merge']
 out = subprocess.run(cmd, stdout=subprocess.PIPE)
 print(out.stdout.decode())
-
-data_path = Path().joinpath('covidclinicaldata/data')
-
-df = pd.DataFrame([])
-for csv in data_path.glob('*.csv'):
-    dft = pd.read_csv(csv)
-    df = pd.concat([df, dft])
-
 os.chdir('../scripts')
 
+sources = clinical_data.files()
+outputs = ['../charts/clinical_temperature_histogram.html',
+           '../charts/covid-19_positive_symptom_correlation_matrix.html',
+           '../charts/covid-19_negative_symptom_correlation_matrix.html',
+           '../charts/covid-19_symptom_correlation_matrix.html']
+code = buildcache.key(Path(__file__), Path(clinical_data.__file__),
+                      Path(clinical_stats.__file__))
+key = buildcache.key(code, [d for _, d in sources])
+if buildcache.restore('clinical', key):
+    raise SystemExit
+
+with instrument.stage('load', rows_in=len(sources)) as s:
+    df = clinical_data.load(
+        workers=int(os.environ.get('CLINICAL_WORKERS', 1)))
+    s['rows_out'] = len(df)
+
 df = df.rename(columns={'temperature': 'temperature_C'})
 df['temperature_F'] = df['temperature_C'] * 9 / 5 + 32
 num_cols = []
@@ -48,7 +63,27 @@ fig.write_html('../charts/clinical_temperature_histogram.html')
 
 corr_cols = ['age', 'temperature_F', 'pulse', 'sys', 'dia', 'rr',
        'sats', 'days_since_symptom_onset']
-corr = df[corr_cols].corr()
+
+
+# Correlations are merged from per-file moments, so only new weekly files
+# are read again.
+def numeric_moments(path, digest):
+    dft = clinical_data.read(path, digest)
+    dft['temperature_F'] = dft['temperature'] * 9 / 5 + 32
+    return clinical_stats.Moments(corr_cols).update(
+        dft[corr_cols].to_numpy(dtype='float64'))
+
+
+def symptom_moments(path, digest):
+    dft = clinical_data.read(path, digest)
+    return clinical_stats.Moments(bool_cols).update(
+        clinical_stats.symptom_matrix(dft, bool_cols),
+        dft.covid19_test_results)
+
+
+with instrument.stage('numeric_moments', rows_in=len(df)):
+    corr = clinical_stats.cached_moments('numeric', sources, numeric_moments,
+                                         [corr_cols, code]).corr()
 fig = px.imshow(
     corr,
     x=corr_cols,
@@ -60,19 +95,17 @@ fig = px.imshow(
 # fig.write_html('../charts/numerical_symptom_correlation_matrix.html')
 
 
-for c in bool_cols:
-    idx = df[df[c] == True].index
-    df.at[idx, c] = 1
-    idx = df[df[c] == False].index
-    df.at[idx, c] = -1
-    df[c] = df[c].fillna(0)
+with instrument.stage('symptom_moments', rows_in=len(df)):
+    bool_moments = clinical_stats.cached_moments('symptoms', sources,
+                                                 symptom_moments,
+                                                 [bool_cols, code])
 
-bool_corr_pos = df[bool_cols][df.covid19_test_results == 'Positive'].corr()
-bool_corr_pos = pd.melt(bool_corr_pos.reset_index(), id_vars='index')
+bool_corr_pos = pd.melt(bool_moments.corr('Positive').reset_index(),
+                        id_vars='index')
 bool_corr_pos.columns = ['x', 'y', 'value']
 
-bool_corr_neg = df[bool_cols][df.covid19_test_results == 'Negative'].corr()
-bool_corr_neg = pd.melt(bool_corr_neg.reset_index(), id_vars='index')
+bool_corr_neg = pd.melt(bool_moments.corr('Negative').reset_index(),
+                        id_vars='index')
 bool_corr_neg.columns = ['x', 'y', 'value']
 
 fig = px.scatter(
@@ -157,3 +190,11 @@ fig.update_layout(
         )
     )
 fig.write_html('../charts/covid-19_symptom_correlation_matrix.html')
+
+with instrument.stage('store') as s:
+    s['outputs'] = outputs
+    buildcache.store('clinical', key, outputs)
+if instrument.ENABLED:
+    path = instrument.write_report(instrument.records(), 'clinical',
+                                   wall=round(time.perf_counter() - start, 3))
+    print(f'Run report written to {path}.')
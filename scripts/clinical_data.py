@@ -0,0 +1,114 @@
+"""Loader for the COVID-19 Clinical Data Repository (``covidclinicaldata``).
+
+The repository adds one CSV per week to ``data/covidclinicaldata/data``.
+Each file is parsed with the explicit ``SCHEMA`` below and kept as Parquet
+under ``data/cache/clinical``, keyed by the hash of the raw file and of
+``SCHEMA``, so a run with one new weekly file only parses that file. The
+combined table is cached too, keyed by the set of file hashes, and files
+that still need parsing can be spread over a process pool.
+"""
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = ROOT.joinpath('data', 'covidclinicaldata', 'data')
+CACHE_DIR = ROOT.joinpath('data', 'cache', 'clinical')
+
+FLAG_COLS = ['high_risk_exposure_occupation', 'high_risk_interactions',
+             'diabetes', 'chd', 'htn', 'cancer', 'asthma', 'copd',
+             'autoimmune_dis', 'smoker', 'ctab', 'labored_respiration',
+             'rhonchi', 'wheezes', 'cough', 'fever', 'sob', 'diarrhea',
+             'fatigue', 'headache', 'loss_of_smell', 'loss_of_taste',
+             'runny_nose', 'muscle_sore', 'sore_throat', 'er_referral']
+NUMBER_COLS = ['age', 'temperature', 'pulse', 'sys', 'dia', 'rr', 'sats',
+               'days_since_symptom_onset']
+CATEGORY_COLS = ['test_name', 'swab_type', 'covid19_test_results',
+                 'rapid_flu_results', 'rapid_strep_results',
+                 'cough_severity', 'sob_severity', 'cxr_findings',
+                 'cxr_impression', 'cxr_label']
+
+# Columns missing from a file are ignored by read_csv; columns not listed
+# here (e.g. added upstream later) are still inferred.
+SCHEMA = dict([(c, 'boolean') for c in FLAG_COLS] +
+              [(c, 'float64') for c in NUMBER_COLS] +
+              [(c, 'category') for c in CATEGORY_COLS])
+# part of every cache name, so a schema change re-parses the files
+SCHEMA_TAG = hashlib.sha1(repr(sorted(SCHEMA.items())).encode()) \
+    .hexdigest()[:8]
+
+
+def _digest(path):
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _cached_path(path, digest):
+    return CACHE_DIR.joinpath(
+        f'{path.stem}-{digest[:16]}-{SCHEMA_TAG}.parquet')
+
+
+def _parse(path, digest):
+    for old in CACHE_DIR.glob(f'{path.stem}-*.parquet'):
+        old.unlink()
+    df = pd.read_csv(path, dtype=SCHEMA)
+    df.to_parquet(_cached_path(path, digest), index=False)
+    return len(df)
+
+
+def _combine(frames):
+    # files with different categories concatenate to object; restore them
+    df = pd.concat(frames, ignore_index=True)
+    for c in CATEGORY_COLS:
+        if c in df:
+            df[c] = df[c].astype('category')
+    return df
+
+
+def files(data_dir=DATA_DIR):
+    """(path, content hash) of every clinical CSV, in name order."""
+    paths = sorted(Path(data_dir).glob('*.csv'))
+    return [(p, _digest(p)) for p in paths]
+
+
+def read(path, digest):
+    """One clinical CSV as a frame, parsed only if not cached yet."""
+    if not _cached_path(path, digest).exists():
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _parse(path, digest)
+    return pd.read_parquet(_cached_path(path, digest))
+
+
+def load(data_dir=DATA_DIR, workers=1):
+    """All clinical CSVs in ``data_dir`` as one frame.
+
+    Files without a cached copy are parsed in ``workers`` processes.
+    """
+    found = files(data_dir)
+    key = hashlib.sha1(''.join(d for _, d in found).encode()).hexdigest()
+    combined = CACHE_DIR.joinpath(
+        f'combined-{key[:16]}-{SCHEMA_TAG}.parquet')
+    if combined.exists():
+        logging.info(f'Clinical data: {len(found)} files unchanged, '
+                     f'using cache.')
+        return pd.read_parquet(combined)
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    missing = [(p, d) for p, d in found
+               if not _cached_path(p, d).exists()]
+    logging.info(f'Clinical data: parsing {len(missing)} of '
+                 f'{len(found)} files.')
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(_parse, *zip(*missing)))
+    else:
+        for p, d in missing:
+            _parse(p, d)
+
+    df = _combine([pd.read_parquet(_cached_path(p, d)) for p, d in found])
+    for old in CACHE_DIR.glob('combined-*.parquet'):
+        old.unlink()
+    df.to_parquet(combined, index=False)
+    return df
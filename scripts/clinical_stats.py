@@ -0,0 +1,137 @@
+"""Symptom matrix and per-group correlations for the clinical data.
+
+Symptom and risk flags are tri-state: reported present, reported absent or
+not recorded. ``symptom_matrix`` encodes them as +1/-1/0 in one int8
+matrix.
+
+Correlations come from ``Moments``, which keeps per-group pairwise counts,
+sums, sums of squares and cross-products. These add up, so the moments of
+each weekly file are computed once, cached with ``cached_moments`` and
+merged; a new file only costs its own rows, and each extra stratum (test
+result, age band, ...) only one small matrix product per group.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT.joinpath('data', 'cache', 'clinical', 'moments')
+
+
+def symptom_matrix(df, cols):
+    """Rows x ``cols`` int8 matrix: True -> 1, False -> -1, missing -> 0."""
+    b = df[cols].astype('float64').to_numpy()
+    return np.nan_to_num(2 * b - 1).astype(np.int8)
+
+
+class Moments:
+    """Pairwise sufficient statistics for Pearson correlation, per group.
+
+    For every group and pair of columns (i, j) over the rows where both are
+    present: ``n`` the count, ``sx[i, j]`` the sum of column i, ``sxx[i, j]``
+    its sum of squares and ``sxy[i, j]`` the sum of products. Missing values
+    are NaN, so ``corr`` matches ``DataFrame.corr()`` on each group.
+    """
+
+    STATS = ('n', 'sx', 'sxx', 'sxy')
+
+    def __init__(self, cols):
+        self.cols = list(cols)
+        self.groups = dict()
+
+    def _stats(self, label):
+        if label not in self.groups:
+            k = len(self.cols)
+            self.groups[label] = {s: np.zeros((k, k)) for s in self.STATS}
+        return self.groups[label]
+
+    def update(self, x, groups=None):
+        """Add the rows of ``x``; ``groups`` labels them (default 'all').
+
+        Rows with a missing label are skipped.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if groups is None:
+            codes, labels = np.zeros(len(x), dtype=int), ['all']
+        else:
+            codes, labels = pd.factorize(groups, sort=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+        x = x[order]
+        present = ~np.isnan(x)
+        p = present.astype(np.float64)
+        x0 = np.where(present, x, 0)
+        for g, label in enumerate(labels):
+            rows = slice(bounds[g], bounds[g + 1])
+            xg, pg = x0[rows], p[rows]
+            stats = self._stats(label)
+            stats['n'] += pg.T @ pg
+            stats['sx'] += xg.T @ pg
+            stats['sxx'] += (xg * xg).T @ pg
+            stats['sxy'] += xg.T @ xg
+        return self
+
+    def merge(self, other):
+        """Add the statistics of ``other`` (same columns) to this one."""
+        for label, theirs in other.groups.items():
+            mine = self._stats(label)
+            for s in self.STATS:
+                mine[s] += theirs[s]
+        return self
+
+    def corr(self, label='all'):
+        """Correlation DataFrame of one group."""
+        n, sx, sxx, sxy = (self.groups[label][s] for s in self.STATS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = n * sxx - sx * sx
+            corr = (n * sxy - sx * sx.T) / np.sqrt(var * var.T)
+        corr[(n < 2) | (var <= 0) | (var.T <= 0)] = np.nan
+        return pd.DataFrame(corr, index=self.cols, columns=self.cols)
+
+    def save(self, path):
+        labels = list(self.groups)
+        np.savez(path, cols=np.array(self.cols), labels=np.array(labels),
+                 **{s: np.array([self.groups[g][s] for g in labels])
+                    for s in self.STATS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            out = cls(f['cols'].tolist())
+            for i, label in enumerate(f['labels'].tolist()):
+                out.groups[label] = {s: f[s][i] for s in cls.STATS}
+        return out
+
+
+def grouped_corr(m, groups, cols):
+    """{group label: correlation DataFrame} for the rows of ``m``."""
+    moments = Moments(cols).update(m, groups)
+    return {label: moments.corr(label) for label in moments.groups}
+
+
+def cached_moments(name, files, compute, version=''):
+    """Merge the moments of every file, computing only uncached ones.
+
+    ``files`` are (path, content hash) pairs, ``compute`` maps one pair to
+    its ``Moments`` and ``version`` should change with whatever ``compute``
+    depends on (columns, groups, the code that reads and encodes a file).
+    """
+    tag = hashlib.sha1(f'{name}{version}'.encode()).hexdigest()[:8]
+    total, used = None, set()
+    for path, digest in files:
+        cached = CACHE_DIR.joinpath(f'{name}-{tag}-{digest[:16]}.npz')
+        if cached.exists():
+            moments = Moments.load(cached)
+        else:
+            moments = compute(path, digest)
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            moments.save(cached)
+        used.add(cached)
+        total = moments if total is None else total.merge(moments)
+    # drop moments of older versions and of files that changed or went away
+    for old in CACHE_DIR.glob(f'{name}-*.npz'):
+        if old not in used:
+            old.unlink()
+    return total
@@ -0,0 +1,142 @@
+"""Entity enrichment: ISO codes, continents, state abbreviations, population.
+
+Each distinct name is resolved once (pycountry, ``us`` and the lookup
+tables in ``data/``) and the result is kept in a JSON cache under
+``data/cache/enrich``, so the costly fuzzy lookups only run for names that
+have never been seen. The resolved table is attached to a panel with one
+``map`` per column, so the cost follows the number of entities rather than
+the number of rows.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+import pycountry
+import us
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT.joinpath('data', 'cache', 'enrich')
+
+continent_extra = {'US': 'North America', 'UK': 'Europe',
+                   'Cabo Verde': 'Africa', 'Congo (Brazzaville)': 'Africa',
+                   'Congo (Kinshasa)': 'Africa', 'Czechia': 'Europe',
+                   'Diamond Princess': 'Asia', 'Eswatini': 'Africa',
+                   'Korea, South': 'Asia', 'Kyrgyzstan': 'Asia',
+                   'North Macedonia': 'Europe', 'Taiwan*': 'Asia',
+                   'Laos': 'Asia', 'West Bank and Gaza': 'Asia',
+                   'Kosovo': 'Europe', 'Burma': 'Asia',
+                   'MS Zaandam': 'North America',
+                   'Summer Olympics 2020': 'Asia',
+                   'Winter Olympics 2022': 'Asia'}
+
+country_correction = {
+    'Burma': 'Myanmar',
+    'Congo (Brazzaville)': 'Republic of the Congo',
+    'Congo (Kinshasa)': 'Congo, The Democratic Republic of the',
+    'Korea, South': 'Korea, Republic of',
+    'Laos': "Lao People's Democratic Republic",
+    'Taiwan*': 'Taiwan',
+    'West Bank and Gaza': 'Palestine, State of',
+    }
+
+
+def _version(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else repr(p).encode())
+    return h.hexdigest()
+
+
+def resolve(kind, names, resolver, version=''):
+    """Resolve each distinct name once, reusing the on-disk cache.
+
+    ``resolver`` maps a name to a dict of column values. Cached entries are
+    discarded when ``version`` (a hash of the lookup tables) changes.
+    Returns a frame indexed by name.
+    """
+    path = CACHE_DIR.joinpath(f'{kind}.json')
+    cache = {'version': version, 'entries': dict()}
+    if path.exists():
+        with open(path) as f:
+            cached = json.load(f)
+        if cached.get('version') == version:
+            cache = cached
+    entries = cache['entries']
+    names = list(pd.unique(pd.Series(names).dropna()))
+    missing = [n for n in names if n not in entries]
+    for n in missing:
+        entries[n] = resolver(n)
+    if missing:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+    return pd.DataFrame.from_dict({n: entries[n] for n in names},
+                                  orient='index')
+
+
+def attach(df, key, table, columns=None):
+    """Add the columns of ``table`` to ``df`` by mapping ``df[key]``."""
+    for c in columns or table.columns:
+        df[c] = df[key].map(table[c])
+    return df
+
+
+def country_table(names):
+    """JHU country name -> corrected name, continent and ISO alpha-3 code."""
+    fp = ROOT.joinpath('data', 'country-and-continent-codes-list.csv')
+    df_con = pd.read_csv(fp)
+    continent_map = dict(zip(df_con.Country_Name, df_con.Continent_Name))
+    continent_map.update(continent_extra)
+
+    def find_continent(country):
+        for key, value in continent_map.items():
+            if country in key:
+                return value
+        print(f'Continent not assigned for {country}.')
+
+    def assign_alpha(x):
+        try:
+            a = pycountry.countries.get(name=x).alpha_3
+            return a
+        except AttributeError:
+            try:
+                a = pycountry.countries.get(common_name=x).alpha_3
+                return a
+            except AttributeError:
+                try:
+                    a = pycountry.countries.search_fuzzy(x)
+                    a = a[0].alpha_3
+                    return a
+                except LookupError:
+                    print(f'No country data for {x}.')
+                    return x
+
+    def resolver(name):
+        corrected = country_correction.get(name, name)
+        return {'Country': corrected,
+                'Continent': find_continent(name),
+                'iso_alpha_3': assign_alpha(corrected)}
+
+    version = _version(fp.read_bytes(), continent_extra, country_correction,
+                       getattr(pycountry, '__version__', ''))
+    return resolve('countries', names, resolver, version)
+
+
+def state_table(names):
+    """US state name -> postal abbreviation and population."""
+    fp = ROOT.joinpath('data', 'us_population.csv')
+    pop = pd.read_csv(fp).set_index('state')
+
+    def resolver(name):
+        info = {'state_abbr': None, 'population': None}
+        try:
+            info['state_abbr'] = us.states.lookup(name).abbr
+            info['population'] = float(pop.population.loc[name])
+        except KeyError:
+            print(f'Cannot find population for {name}.')
+        except AttributeError:
+            print(f'Cannot find abbreviation for {name}.')
+        return info
+
+    return resolve('states', names, resolver, _version(fp.read_bytes()))
@@ -1,7 +1,20 @@
+"""Build ``index.html`` from the chart manifest.
+
+``charts/manifest.json`` records, per chart, the hash and size of its
+output files, the date of the data it shows, how long it took to build
+and when its content last changed. The build records each chart as it
+finishes; ``build_index`` refreshes the hashes (which also covers charts
+written outside the build) and only rewrites ``index.html`` when the
+rendered page differs.
+"""
+import hashlib
+import json
 from pathlib import Path
 from datetime import datetime
 
-html = """<!DOCTYPE html>
+MANIFEST = Path('charts', 'manifest.json')
+
+header = """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta name="viewport" content="width=device-width, initial-scale=1" charset="UTF-8">
@@ -29,20 +42,97 @@ html = """<!DOCTYPE html>
 <tr>
     <th>Last Updated</th>
     <th>Chart Name</th>
+    <th>Data Through</th>
+    <th>Size</th>
 </tr>
 """
-for p in Path('charts').glob('*.html'):
-    dtg = datetime.fromtimestamp(p.stat().st_mtime).strftime('%Y-%m-%d %H:%M')
-    name = ' '.join(p.stem.split('_'))
-    html += f'<tr>\n'\
-            f'    <td>{dtg}</td>\n'\
-            f'    <td><a href="{p.as_posix()}">{name.title()}</a></td>\n'\
-            f'</tr>\n'
-
-html += """</table>
+footer = """</table>
 </body>
 </html>
 """
 
-with open('index.html', 'w') as f:
-    f.write(html)
+
+def load_manifest():
+    if MANIFEST.exists():
+        with open(MANIFEST) as f:
+            return json.load(f)
+    return dict()
+
+
+def save_manifest(manifest):
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def outputs(name):
+    html = Path('charts', f'{name}.html')
+    return [p for p in (html, html.with_suffix('.frames.json')) if p.exists()]
+
+
+def record(name, seconds=None, data_date=None, manifest=None):
+    """Update the manifest entry of chart ``name`` from its output files.
+
+    Saves the manifest unless one is passed in.
+    """
+    save = manifest is None
+    manifest = load_manifest() if save else manifest
+    h = hashlib.sha1()
+    size = 0
+    for p in outputs(name):
+        raw = p.read_bytes()
+        h.update(raw)
+        size += len(raw)
+    entry = manifest.get(name, dict())
+    if entry.get('sha1') != h.hexdigest():
+        entry['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+    entry.update(sha1=h.hexdigest(), bytes=size)
+    if seconds is not None:
+        entry['seconds'] = round(seconds, 1)
+    if data_date is not None:
+        entry['data_date'] = data_date
+    manifest[name] = entry
+    if save:
+        save_manifest(manifest)
+    return entry
+
+
+def _size(n):
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024 or unit == 'MB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+
+
+def build_index():
+    manifest = load_manifest()
+    before = json.dumps(manifest, sort_keys=True)
+    charts = sorted(p.stem for p in Path('charts').glob('*.html'))
+    for name in charts:
+        record(name, manifest=manifest)
+    for name in set(manifest) - set(charts):
+        del manifest[name]
+    if json.dumps(manifest, sort_keys=True) != before:
+        save_manifest(manifest)
+
+    html = header
+    for name in charts:
+        entry = manifest[name]
+        title = ' '.join(name.split('_')).title()
+        html += f'<tr>\n'\
+                f'    <td>{entry["updated"]}</td>\n'\
+                f'    <td><a href="charts/{name}.html">{title}</a></td>\n'\
+                f'    <td>{entry.get("data_date", "")}</td>\n'\
+                f'    <td>{_size(entry["bytes"])}</td>\n'\
+                f'</tr>\n'
+    html += footer
+
+    index = Path('index.html')
+    if index.exists() and index.read_text() == html:
+        return
+    with open(index, 'w') as f:
+        f.write(html)
+
+
+if __name__ == '__main__':
+    build_index()
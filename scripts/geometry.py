@@ -0,0 +1,234 @@
+"""Pre-projected, FIPS-keyed copies of the Census state and county shapes.
+
+Reading the shapefiles and reprojecting them dominated the start-up of the
+map scripts. ``load`` does that once per source file, target CRS and set of
+per-state overrides and keeps the result as Parquet with WKB geometry under
+``data/cache/geometry``. The cache key includes a hash of the shapefile and
+its sidecar files, so a new download replaces the cached copy.
+
+``simplified`` derives lighter copies for the web outputs. Rings are
+quantized to the level's precision and cut into arcs at the points where
+neighbouring shapes meet; each arc is simplified once, so two counties
+sharing a border keep exactly the same border at every level.
+"""
+import hashlib
+import logging
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.wkb
+from shapely.geometry import MultiPolygon, Polygon
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT.joinpath('data', 'cache', 'geometry')
+STATE_SHAPES = ROOT.joinpath('data', 'gz_2010_us_040_00_5m',
+                             'gz_2010_us_040_00_5m.shp')
+COUNTY_SHAPES = ROOT.joinpath('data', 'gz_2010_us_050_00_500k',
+                              'gz_2010_us_050_00_500k.shp')
+
+# Alaska and Hawaii are drawn in their own projections on the state maps.
+INSET_EPSG = {'02': 3467, '15': 4135}
+
+# level -> (Douglas-Peucker tolerance, decimals kept), in units of the CRS;
+# the values suit EPSG 4326 degrees.
+LEVELS = {'full': (0, 6),
+          'high': (0.0005, 5),
+          'medium': (0.002, 4),
+          'low': (0.01, 3)}
+
+
+def _digest(path, epsg, overrides):
+    h = hashlib.sha1()
+    for ext in ('.shp', '.shx', '.dbf', '.prj'):
+        part = path.with_suffix(ext)
+        if part.exists():
+            h.update(part.read_bytes())
+    h.update(repr((epsg, sorted((overrides or dict()).items()))).encode())
+    return h.hexdigest()
+
+
+def _project(path, epsg, overrides):
+    logging.info(f'Reading {path.name} and converting to EPSG {epsg}.')
+    gdf = gpd.read_file(path).to_crs(epsg=epsg)
+    for state, code in (overrides or dict()).items():
+        idx = gdf.STATE == state
+        gdf.loc[idx, 'geometry'] = gdf[idx].to_crs(epsg=code).geometry
+    gdf['fips'] = gdf.GEO_ID.str.split('US').str[-1]
+    return gdf
+
+
+def _read(cached, epsg):
+    df = pd.read_parquet(cached)
+    geoms = [shapely.wkb.loads(g) for g in df.pop('geometry')]
+    return gpd.GeoDataFrame(df, geometry=geoms, crs=f'epsg:{epsg}')
+
+
+def _write(gdf, stem, cached):
+    df = pd.DataFrame(gdf.drop(columns='geometry'))
+    df['geometry'] = [shapely.wkb.dumps(g) for g in gdf.geometry]
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for old in CACHE_DIR.glob(f'{stem}-*.parquet'):
+        old.unlink()
+    df.to_parquet(cached, index=False)
+
+
+def load(path, epsg, overrides=None):
+    """Shapes of ``path`` in EPSG ``epsg`` with a ``fips`` column.
+
+    ``overrides`` maps state FIPS codes to an EPSG code used for that
+    state's rows instead, e.g. ``INSET_EPSG``.
+    """
+    path = Path(path)
+    digest = _digest(path, epsg, overrides)
+    stem = f'{path.stem}-{epsg}'
+    cached = CACHE_DIR.joinpath(f'{stem}-{digest[:16]}.parquet')
+    if cached.exists():
+        logging.info(f'{path.name}: using projected cache ({epsg}).')
+        return _read(cached, epsg)
+
+    gdf = _project(path, epsg, overrides)
+    _write(gdf, stem, cached)
+    return gdf
+
+
+def _douglas_peucker(pts, tolerance):
+    """Indices of ``pts`` kept by Douglas-Peucker; both ends are kept."""
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        seg = pts[j] - pts[i]
+        rel = pts[i + 1:j] - pts[i]
+        norm = np.hypot(*seg)
+        if norm == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return np.flatnonzero(keep)
+
+
+def _junctions(rings):
+    """Points where the set of rings sharing a vertex changes."""
+    owners = dict()
+    for r, ring in enumerate(rings):
+        for p in ring:
+            owners.setdefault(p, set()).add(r)
+    junctions = set()
+    for ring in rings:
+        keys = [frozenset(owners[p]) for p in ring]
+        n = len(ring)
+        found = False
+        for i in range(n):
+            if len(keys[i]) > 2 or keys[i] != keys[i - 1] \
+                    or keys[i] != keys[(i + 1) % n]:
+                junctions.add(ring[i])
+                found = True
+        if not found:
+            # a ring shared whole (or not at all) is cut at its least point
+            junctions.add(min(ring))
+    return junctions
+
+
+def simplify_rings(shapes, tolerance, decimals):
+    """Topology-preserving simplification of nested coordinate rings.
+
+    ``shapes`` is a list of shapes, each a list of parts, each a list of
+    rings (exterior first) given as closed ``(x, y)`` sequences. Returns
+    the same nesting with simplified closed rings; parts whose exterior
+    collapses are dropped, but every shape keeps its largest part.
+    """
+    rings = list()
+    for shape in shapes:
+        for part in shape:
+            for ring in part:
+                q = np.round(np.asarray(ring, dtype=float)[:, :2], decimals)
+                pts = [tuple(p) for p in q]
+                # open ring without repeated consecutive vertices
+                pts = [p for i, p in enumerate(pts) if p != pts[i - 1]] \
+                    if len(pts) > 1 else pts
+                rings.append(pts)
+    junctions = _junctions([r for r in rings if len(r) >= 3])
+
+    arcs = dict()
+
+    def arc(points):
+        key = min(tuple(points), tuple(points[::-1]))
+        if key not in arcs:
+            pts = np.array(key)
+            arcs[key] = [key[i] for i in _douglas_peucker(pts, tolerance)] \
+                if tolerance else list(key)
+        out = arcs[key]
+        return out if key == tuple(points) else out[::-1]
+
+    def simplify(ring):
+        if len(ring) < 3:
+            return None
+        cuts = [i for i, p in enumerate(ring) if p in junctions]
+        ring = ring[cuts[0]:] + ring[:cuts[0]]
+        cuts = [c - cuts[0] for c in cuts] + [len(ring)]
+        ring = ring + ring[:1]
+        out = [ring[0]]
+        for i, j in zip(cuts[:-1], cuts[1:]):
+            out += arc(ring[i:j + 1])[1:]
+        return out if len(out) >= 4 else None
+
+    it = iter(rings)
+    result = list()
+    for shape in shapes:
+        parts = list()
+        for part in shape:
+            done = [simplify(next(it)) for _ in part]
+            if done and done[0] is not None:
+                parts.append([done[0]] + [r for r in done[1:] if r])
+        if not parts and shape:
+            largest = max(shape, key=lambda p: len(p[0]))
+            parts.append([[tuple(p[:2]) for p in largest[0]]])
+        result.append(parts)
+    return result
+
+
+def _rings(geom):
+    polys = getattr(geom, 'geoms', [geom])
+    return [[p.exterior.coords] + [r.coords for r in p.interiors]
+            for p in polys]
+
+
+def _geometry(parts):
+    polys = [Polygon(part[0], part[1:]) for part in parts]
+    return polys[0] if len(polys) == 1 else MultiPolygon(polys)
+
+
+def simplified(path, epsg, level='medium', overrides=None):
+    """``load`` with the shapes simplified and quantized to ``level``.
+
+    ``level`` is a key of ``LEVELS``; each level is cached separately. The
+    tolerances and decimals are in degrees, so only 'full' is meaningful
+    for a projected ``epsg``.
+    """
+    path = Path(path)
+    tolerance, decimals = LEVELS[level]
+    digest = _digest(path, epsg, overrides)
+    stem = f'{path.stem}-{epsg}-{level}'
+    cached = CACHE_DIR.joinpath(f'{stem}-{digest[:16]}.parquet')
+    if cached.exists():
+        logging.info(f'{path.name}: using {level} cache ({epsg}).')
+        return _read(cached, epsg)
+
+    gdf = load(path, epsg, overrides)
+    logging.info(f'Simplifying {path.name} to level {level}.')
+    shapes = simplify_rings([_rings(g) for g in gdf.geometry],
+                            tolerance, decimals)
+    gdf = gdf.copy()
+    gdf['geometry'] = [_geometry(parts) for parts in shapes]
+    _write(gdf, stem, cached)
+    return gdf
@@ -0,0 +1,180 @@
+"""Growth-rate columns shared by the time-analysis scripts.
+
+All entities (states, countries, counties) are computed at once on an
+entity x date matrix instead of splitting the long frame per entity. The
+input is expected to hold one row per entity and day, as the melted JHU
+time series do. ``calc_rolling_metrics`` adds trailing-window sums and
+means, the week-over-week change and doubling times the same way.
+"""
+import numpy as np
+import pandas as pd
+
+GROWTH_COLS = ['today', 'yesterday', 'growth_rate', 'rolling_growth_rate']
+WINDOWS = (7, 14)
+
+
+def ffill(a):
+    """Forward fill NaNs along the last axis of a 2-D array."""
+    idx = np.where(np.isnan(a), 0, np.arange(a.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return a[np.arange(a.shape[0])[:, None], idx]
+
+
+def rolling_mean(a, window):
+    """Trailing ``window``-column mean along axis 1, ignoring NaNs."""
+    pad = np.full((a.shape[0], window - 1), np.nan)
+    view = np.lib.stride_tricks.sliding_window_view(
+        np.hstack([pad, a]), window, axis=1)
+    count = (~np.isnan(view)).sum(axis=2)
+    with np.errstate(invalid='ignore'):
+        return np.where(count > 0, np.nansum(view, axis=2) / count, np.nan)
+
+
+def rolling_sum(a, window):
+    """Trailing ``window``-column sum along axis 1.
+
+    NaN until ``window`` columns are available and wherever the window
+    holds a NaN, like ``Series.rolling(window).sum()``.
+    """
+    missing = np.isnan(a)
+    total = np.zeros((a.shape[0], a.shape[1] + 1))
+    gaps = np.zeros(total.shape, dtype=int)
+    np.cumsum(np.where(missing, 0, a), axis=1, out=total[:, 1:])
+    np.cumsum(missing, axis=1, out=gaps[:, 1:])
+    out = np.full(a.shape, np.nan)
+    out[:, window - 1:] = total[:, window:] - total[:, :-window]
+    out[:, window - 1:][gaps[:, window:] > gaps[:, :-window]] = np.nan
+    return out
+
+
+def shift(a, periods):
+    """``a`` moved ``periods`` columns to the right, NaN filled."""
+    out = np.full(a.shape, np.nan)
+    out[:, periods:] = a[:, :a.shape[1] - periods]
+    return out
+
+
+def growth_matrices(confirmed, context=None):
+    """Growth metrics for an entity x day matrix of cumulative counts.
+
+    ``context`` optionally maps ``today``/``yesterday``/``growth_rate`` to
+    already computed matrices for the leading columns of ``confirmed``;
+    those columns are taken as-is rather than recomputed, which is how an
+    incremental run continues from saved history.
+    """
+    confirmed = confirmed.astype(float)
+    n = 0 if context is None else context['today'].shape[1]
+
+    today = np.zeros_like(confirmed)
+    today[:, 1:] = np.diff(confirmed, axis=1)
+    today = np.nan_to_num(today, nan=0.)
+    if n:
+        today[:, :n] = context['today']
+
+    yesterday = np.full_like(today, np.nan)
+    yesterday[:, 1:] = today[:, :-1]
+    if n:
+        yesterday[:, :n] = context['yesterday']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth_rate = np.round(today / yesterday - 1, 3)
+    growth_rate[np.isinf(growth_rate)] = np.nan
+    if n:
+        growth_rate[:, :n] = context['growth_rate']
+    growth_rate = ffill(growth_rate)
+
+    rolling = np.round(rolling_mean(np.clip(growth_rate, -5, 5), 14), 3)
+    return {'today': today, 'yesterday': yesterday,
+            'growth_rate': growth_rate, 'rolling_growth_rate': rolling}
+
+
+def calc_growth_rate(df, key, context=None):
+    """Add today/yesterday/growth_rate/rolling_growth_rate to every entity.
+
+    Rows come back grouped by ``key`` in order of first appearance and
+    sorted by ``Date`` within each entity. ``context`` holds the trailing,
+    already computed rows preceding ``df`` (see ``incremental.context``);
+    only the rows of ``df`` are returned.
+    """
+    entities = pd.unique(df[key])
+    df = df.assign(_order=pd.Categorical(df[key], categories=entities).codes)
+    df = df.sort_values(['_order', 'Date'], kind='mergesort')
+    dates = np.sort(pd.unique(df.Date))
+
+    ctx, ctx_dates = None, []
+    if context is not None and len(context):
+        ctx_dates = np.sort(pd.unique(context.Date))
+        wide = {c: context.pivot(index=key, columns='Date', values=c)
+                .reindex(index=entities, columns=ctx_dates).values
+                for c in ['Confirmed', 'today', 'yesterday', 'growth_rate']}
+        ctx = {c: wide[c] for c in ['today', 'yesterday', 'growth_rate']}
+    confirmed = df.pivot(index=key, columns='Date', values='Confirmed') \
+        .reindex(index=entities, columns=dates).values
+    if ctx is not None:
+        confirmed = np.hstack([wide['Confirmed'], confirmed])
+
+    metrics = growth_matrices(confirmed, ctx)
+    rows = df['_order'].values
+    cols = np.searchsorted(dates, df.Date.values) + len(ctx_dates)
+    for c in GROWTH_COLS:
+        df[c] = metrics[c][rows, cols]
+    return df.drop(columns='_order').reset_index(drop=True)
+
+
+def rolling_matrices(daily, cumulative, windows=WINDOWS):
+    """Rolling metrics for entity x day matrices of daily and total counts.
+
+    For every window ``w``: ``sum_w`` and ``mean_w`` of the daily counts
+    and ``doubling_time_w``, the days the total takes to double at the
+    growth of the last ``w`` days (NaN without growth).
+    ``weekly_change`` is the percent change of ``mean_7`` from the week
+    before, relative to the current week as the weekly change chart has
+    always shown it.
+    """
+    daily = daily.astype(float)
+    cumulative = cumulative.astype(float)
+    out = dict()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for w in windows:
+            out[f'sum_{w}'] = rolling_sum(daily, w)
+            out[f'mean_{w}'] = out[f'sum_{w}'] / w
+            ratio = cumulative / shift(cumulative, w)
+            doubling = w * np.log(2) / np.log(ratio)
+            doubling[~(ratio > 1)] = np.nan
+            out[f'doubling_time_{w}'] = doubling
+        week = out['mean_7'] if 7 in windows else rolling_sum(daily, 7) / 7
+        out['weekly_change'] = (week - shift(week, 7)) / week * 100
+    out['weekly_change'][np.isinf(out['weekly_change'])] = np.nan
+    return out
+
+
+def calc_rolling_metrics(df, key, daily='today', cumulative='Confirmed',
+                         windows=WINDOWS, latest=False):
+    """Rolling metrics of every entity (see ``rolling_matrices``).
+
+    Returns ``key``, ``Date`` and the metric columns, one row per entity
+    and day in order of first appearance; with ``latest`` only each
+    entity's last day is kept.
+    """
+    entities = pd.unique(df[key])
+    dates = np.sort(pd.unique(df.Date))
+    wide = df.pivot(index=key, columns='Date', values=[daily, cumulative])
+    metrics = rolling_matrices(
+        wide[daily].reindex(index=entities, columns=dates).values,
+        wide[cumulative].reindex(index=entities, columns=dates).values,
+        windows)
+
+    rows = pd.Categorical(df[key], categories=entities).codes
+    cols = np.searchsorted(dates, df.Date.values)
+    if latest:
+        last = np.full(len(entities), -1)
+        np.maximum.at(last, rows, cols)
+        rows, cols = np.arange(len(entities)), last
+        out = pd.DataFrame({key: entities, 'Date': dates[last]})
+    else:
+        order = np.lexsort([cols, rows])
+        rows, cols = rows[order], cols[order]
+        out = pd.DataFrame({key: entities[rows], 'Date': dates[cols]})
+    for name, m in metrics.items():
+        out[name] = m[rows, cols]
+    return out
@@ -0,0 +1,93 @@
+"""Incremental daily update of the long-form time-analysis panels.
+
+A full run melts the whole wide JHU history and recomputes every derived
+column. With ``INCREMENTAL=1`` the scripts instead keep the aggregated wide
+frames and the processed panels from the previous run, find the date
+columns that are new or were revised upstream, and only melt and process
+those. The growth columns are continued from the last ``CONTEXT_DAYS``
+rows of each entity so the 14-day rolling mean comes out unchanged.
+"""
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+STATE_DIR = ROOT.joinpath('data', 'cache', 'incremental')
+ENABLED = os.environ.get('INCREMENTAL', '0') == '1'
+CONTEXT_DAYS = 14
+
+
+def load(name):
+    """Return the frames saved by the previous run of ``name``, or None."""
+    paths = {k: STATE_DIR.joinpath(f'{name}_{k}.parquet')
+             for k in ('confirmed', 'deaths', 'scatter', 'growth')}
+    if not ENABLED or not all(p.exists() for p in paths.values()):
+        return None
+    return {k: pd.read_parquet(p) for k, p in paths.items()}
+
+
+def _frames(panel):
+    return {k: pd.DataFrame(getattr(panel, k), index=panel.entities,
+                            columns=panel.dates.strftime('%Y-%m-%d'))
+            for k in ('confirmed', 'deaths')}
+
+
+def save(name, panel, **frames):
+    """Persist the panel and processed frames for the next run."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    frames.update(_frames(panel))
+    for k, df in frames.items():
+        df.to_parquet(STATE_DIR.joinpath(f'{name}_{k}.parquet'))
+
+
+def changed_dates(previous, current):
+    """Date columns of ``current`` that are new or differ from ``previous``."""
+    common = [c for c in current.columns if c in previous.columns]
+    prev = previous.reindex(index=current.index, columns=common)
+    revised = set((current[common] != prev).any()[lambda s: s].index)
+    return [c for c in current.columns
+            if c not in previous.columns or c in revised]
+
+
+def window(state, panel):
+    """Return (first changed date as ``%Y-%m-%d``, panel view to process)."""
+    if state is None:
+        return None, panel
+    current = _frames(panel)
+    changed = set(changed_dates(state['confirmed'], current['confirmed']))
+    changed |= set(changed_dates(state['deaths'], current['deaths']))
+    if not changed:
+        # nothing to do, but keep a one-day window so the scripts run as usual
+        logging.info('No new or revised dates.')
+        changed = {current['confirmed'].columns[-1]}
+    start = min(changed)
+    logging.info(f'{len(changed)} new or revised dates, '
+                 f'recomputing from {start}.')
+    return start, panel.between(start)
+
+
+def context(growth, key, start):
+    """Trailing ``CONTEXT_DAYS`` processed rows per entity before ``start``."""
+    if growth is None:
+        return None
+    return growth[growth.Date < start].groupby(key).tail(CONTEXT_DAYS)
+
+
+def merge(previous, update, start, key=None):
+    """Replace the rows of ``previous`` from ``start`` on with ``update``.
+
+    With ``key`` the result is ordered entity by entity, as the growth-rate
+    tables are; otherwise the date-major order of the melt is kept.
+    """
+    if previous is None:
+        return update
+    df = pd.concat([previous[previous.Date < start], update],
+                   ignore_index=True)
+    if key is not None:
+        order = {k: i for i, k in enumerate(pd.unique(df[key]))}
+        df = df.assign(_order=df[key].map(order))
+        df = df.sort_values(['_order', 'Date'], kind='mergesort')
+        df = df.drop(columns='_order').reset_index(drop=True)
+    return df
@@ -0,0 +1,106 @@
+"""Opt-in per-stage timing and memory instrumentation.
+
+With ``INSTRUMENT=1`` every ``stage`` block records its wall and CPU time,
+peak traced memory (``tracemalloc``), rows in and out and the bytes of
+the files it wrote. Records are kept per process; the build and the
+standalone scripts collect them from their workers and ``write_report``
+saves one JSON report per run under ``data/cache/reports``, warning about
+stages that got much slower than in the previous report of the same
+script. Without the variable ``stage`` costs nothing.
+
+    with instrument.stage('growth', rows_in=len(df)) as s:
+        sdn = calc_growth_rate(df, 'State')
+        s['rows_out'] = len(sdn)
+        s['outputs'] = ['data/us_confirmed_growth_rate.csv']
+
+Python 3.8 has no ``tracemalloc.reset_peak``, so there a nested stage
+reports the peak since its outermost stage started.
+"""
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REPORT_DIR = ROOT.joinpath('data', 'cache', 'reports')
+ENABLED = os.environ.get('INSTRUMENT', '0') == '1'
+
+# a stage this much slower than in the previous report is logged
+SLOWDOWN = 1.5
+
+_records = list()
+_stack = list()  # [name, peak before the last reset] of the open stages
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)  # Python 3.9+
+
+
+def _size(paths):
+    return sum(Path(p).stat().st_size for p in paths if Path(p).exists())
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Record one pipeline stage; the yielded dict takes ``rows_in``,
+    ``rows_out`` and ``outputs`` (paths written)."""
+    s = {'rows_in': rows_in, 'rows_out': None, 'outputs': []}
+    if not ENABLED:
+        yield s
+        return
+    started = not _stack and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif _reset_peak:
+        # fold the peak so far into the open stages before resetting it
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in _stack:
+            entry[1] = max(entry[1], peak)
+        _reset_peak()
+    entry = [name, 0]
+    _stack.append(entry)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield s
+    finally:
+        peak = max(entry[1], tracemalloc.get_traced_memory()[1])
+        _records.append({
+            'stage': '/'.join(e[0] for e in _stack),
+            'wall': round(time.perf_counter() - wall, 3),
+            'cpu': round(time.process_time() - cpu, 3),
+            'peak_mb': round(peak / 2 ** 20, 1),
+            'rows_in': s['rows_in'], 'rows_out': s['rows_out'],
+            'bytes_written': _size(s['outputs'])})
+        _stack.pop()
+        if started:
+            tracemalloc.stop()
+
+
+def records():
+    """Return and clear the records of this process."""
+    out = list(_records)
+    _records.clear()
+    return out
+
+
+def write_report(stages, name='build', **info):
+    """Save a run report of script ``name``; return its path."""
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    latest = REPORT_DIR.joinpath(f'{name}-latest.json')
+    if latest.exists():
+        with open(latest) as f:
+            before = {s['stage']: s for s in json.load(f)['stages']}
+        for s in stages:
+            old = before.get(s['stage'])
+            if old and old['wall'] > 1 and s['wall'] > SLOWDOWN * old['wall']:
+                logging.warning(f'{s["stage"]} took {s["wall"]:.1f}s, '
+                                f'{old["wall"]:.1f}s in the previous run.')
+    now = datetime.now()
+    report = dict(time=now.isoformat(timespec='seconds'), stages=stages,
+                  **info)
+    path = REPORT_DIR.joinpath(f'{name}-{now:%Y%m%d-%H%M%S}.json')
+    for p in (path, latest):
+        with open(p, 'w') as f:
+            json.dump(report, f, indent=2)
+    return path
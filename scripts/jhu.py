@@ -0,0 +1,201 @@
+"""Shared loader for the JHU CSSE COVID-19 time series.
+
+Every script reads the same wide ``time_series_covid19_*`` CSVs. This module
+fetches each file once from a configurable source and keeps a Parquet copy
+keyed by the content hash of the raw CSV, so repeat runs skip the CSV parser
+and, with an unchanged upstream ETag, the download as well.
+
+The source is chosen with the ``JHU_SOURCE`` environment variable:
+
+* ``url`` (default) - raw files on GitHub,
+* ``submodule`` - the ``data/COVID-19`` git submodule,
+* any other value - a local directory mirroring the time series folder.
+
+The Parquet copy stores the day counts as int32 and is written in row
+groups of ``CHUNK_ROWS``. ``load_time_series`` can select metadata columns
+by name and the days of a date window, and ``load_panel`` streams the
+files a row group at a time straight into an aggregated ``Panel``, so
+only one chunk of the wide county history is in memory at once.
+"""
+import hashlib
+import json
+import logging
+import os
+import urllib.request
+from io import BytesIO
+from pathlib import Path
+from urllib.error import HTTPError
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from panel import DATE_COLUMN, Panel
+
+ROOT = Path(__file__).resolve().parent.parent
+JHU_URL = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/' \
+          'csse_covid_19_data/csse_covid_19_time_series'
+SUBMODULE_DIR = ROOT.joinpath('data', 'COVID-19', 'csse_covid_19_data',
+                              'csse_covid_19_time_series')
+CACHE_DIR = Path(os.environ.get('JHU_CACHE_DIR',
+                                ROOT.joinpath('data', 'cache', 'jhu')))
+# bump when the layout of the Parquet copy changes
+CACHE_FORMAT = 2
+CHUNK_ROWS = 500
+
+# day columns hold cumulative counts; the rest of the numeric metadata
+COUNT_DTYPE = 'int32'
+META_DTYPES = {'UID': 'int64', 'code3': 'int32', 'FIPS': 'float64',
+               'Lat': 'float64', 'Long_': 'float64', 'Long': 'float64',
+               'Population': 'int64'}
+
+
+def file_name(kind, region):
+    return f'time_series_covid19_{kind}_{region}.csv'
+
+
+# one small index per CSV (sha1, etag, source), so the US and global
+# prepare tasks never rewrite each other's entries
+def _index_path(name):
+    return CACHE_DIR.joinpath(f'{Path(name).stem}.json')
+
+
+def _read_entry(name):
+    path = _index_path(name)
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return dict()
+
+
+def _write_entry(name, entry):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _index_path(name)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(entry, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _fetch_url(url, etag=None):
+    """Return (raw bytes, etag); raw is None when the server answers 304."""
+    req = urllib.request.Request(url)
+    if etag:
+        req.add_header('If-None-Match', etag)
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.read(), resp.headers.get('ETag')
+    except HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+
+
+def _cached_path(name, digest):
+    return CACHE_DIR.joinpath(
+        f'{Path(name).stem}-{digest[:16]}-v{CACHE_FORMAT}.parquet')
+
+
+def _store(name, raw, digest):
+    header = pd.read_csv(BytesIO(raw), nrows=0).columns
+    dtypes = {c: COUNT_DTYPE if DATE_COLUMN.match(c) else META_DTYPES[c]
+              for c in header if DATE_COLUMN.match(c) or c in META_DTYPES}
+    df = pd.read_csv(BytesIO(raw), dtype=dtypes)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for old in CACHE_DIR.glob(f'{Path(name).stem}-*.parquet'):
+        old.unlink()
+    df.to_parquet(_cached_path(name, digest), index=False,
+                  row_group_size=CHUNK_ROWS)
+
+
+def _cached(kind, region, source):
+    """Parquet copy of one file, fetched and parsed only when it changed."""
+    source = source or os.environ.get('JHU_SOURCE', 'url')
+    name = file_name(kind, region)
+    entry = _read_entry(name)
+
+    if source == 'url':
+        raw, etag = _fetch_url(f'{JHU_URL}/{name}', entry.get('etag'))
+        if raw is None and _cached_path(name, entry['sha1']).exists():
+            logging.info(f'{name}: upstream unchanged, using cache.')
+            return _cached_path(name, entry['sha1'])
+        if raw is None:
+            raw, etag = _fetch_url(f'{JHU_URL}/{name}')
+    else:
+        folder = SUBMODULE_DIR if source == 'submodule' else Path(source)
+        with open(folder.joinpath(name), 'rb') as f:
+            raw = f.read()
+        etag = None
+
+    digest = hashlib.sha1(raw).hexdigest()
+    path = _cached_path(name, digest)
+    if digest == entry.get('sha1') and path.exists():
+        logging.info(f'{name}: content unchanged, using cache.')
+    else:
+        logging.info(f'{name}: parsing {len(raw):,} bytes from {source}.')
+        _store(name, raw, digest)
+
+    _write_entry(name, {'sha1': digest, 'etag': etag, 'source': str(source)})
+    return path
+
+
+def _columns(path, columns=None, start=None, stop=None):
+    """Metadata ``columns`` (default all) and the day columns in the window."""
+    names = pq.read_schema(path).names
+    days = [c for c in names if DATE_COLUMN.match(c)]
+    dates = pd.to_datetime(days, format='%m/%d/%y')
+    keep = np.ones(len(days), dtype=bool)
+    if start is not None:
+        keep &= dates >= pd.Timestamp(start)
+    if stop is not None:
+        keep &= dates <= pd.Timestamp(stop)
+    if columns is None:
+        columns = [c for c in names if not DATE_COLUMN.match(c)]
+    missing = set(columns).difference(names)
+    if missing:
+        raise KeyError(f'{path.name} has no columns {sorted(missing)}')
+    return list(columns) + [d for d, k in zip(days, keep) if k]
+
+
+def load_time_series(kind, region, source=None, columns=None, start=None,
+                     stop=None):
+    """Load one wide JHU time series, e.g. ``('confirmed', 'US')``.
+
+    ``kind`` is ``confirmed``/``deaths``/``recovered`` and ``region`` is
+    ``US`` or ``global``. ``columns`` names the metadata columns to keep
+    (default all) and ``start``/``stop`` limit the day columns to a date
+    window, both inclusive.
+    """
+    path = _cached(kind, region, source)
+    return pd.read_parquet(path, columns=_columns(path, columns, start, stop))
+
+
+def iter_time_series(kind, region, source=None, columns=None, start=None,
+                     stop=None):
+    """Like ``load_time_series``, yielding frames of ``CHUNK_ROWS`` rows."""
+    path = _cached(kind, region, source)
+    cols = _columns(path, columns, start, stop)
+    f = pq.ParquetFile(path)
+    for i in range(f.num_row_groups):
+        yield f.read_row_group(i, columns=cols).to_pandas()
+
+
+def county_fips(df):
+    """County FIPS code (last five UID digits) of the county rows."""
+    counties = df[df.Admin2.notna()]
+    return counties.UID % 100000
+
+
+def load_panel(region, key, columns=None, source=None, start=None,
+               stop=None, dtype=np.int64):
+    """Confirmed/deaths ``Panel`` of ``region`` summed by ``key``.
+
+    ``key`` is a column name or a function of a row chunk returning the
+    labels of the rows to keep, as ``county_fips`` does; ``columns`` are the
+    metadata columns it needs (default ``[key]``). The files are read one
+    row group at a time.
+    """
+    columns = columns or [key]
+    return Panel.from_chunks(
+        *[iter_time_series(kind, region, source, columns, start, stop)
+          for kind in ('confirmed', 'deaths')], key, dtype)
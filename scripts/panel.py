@@ -0,0 +1,156 @@
+"""Entity x day panel of cumulative confirmed cases and deaths.
+
+The JHU files are wide (one column per day) and the scripts used to melt
+them straight into long frames with string dates and the entity name
+repeated on every row. ``Panel`` keeps the counts as two contiguous
+integer matrices sharing one entity index and one date axis; date-range
+and single-entity selections are NumPy views, and a long frame is only
+built with ``to_long`` where a chart needs one. ``from_chunks`` sums the
+wide rows chunk by chunk, so the full wide frames never have to be loaded.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+DATE_COLUMN = re.compile(r'^\d{1,2}/\d{1,2}/\d{2}$')
+
+
+def date_columns(df):
+    """The ``m/d/yy`` day columns of a wide JHU frame, in file order."""
+    return [c for c in df.columns if DATE_COLUMN.match(str(c))]
+
+
+def _sum_chunks(chunks, key):
+    """(sorted labels, day columns, int64 sums) of wide row chunks by ``key``.
+
+    Totals are kept as NumPy row blocks; a label seen again in a later
+    chunk is added in place, so memory stays at one chunk plus the totals.
+    """
+    where, blocks, cols = dict(), list(), []
+    for chunk in chunks:
+        labels = key(chunk) if callable(key) else chunk[key]
+        cols = date_columns(chunk)
+        codes, uniques = pd.factorize(labels)
+        keep = codes >= 0
+        values = chunk.loc[labels.index[keep], cols].to_numpy(dtype=np.int64)
+        codes = codes[keep]
+        order = np.argsort(codes, kind='stable')
+        starts = np.searchsorted(codes[order], np.arange(len(uniques)))
+        part = np.add.reduceat(values[order], starts) if len(values) else \
+            np.zeros((0, len(cols)), dtype=np.int64)
+        new = list()
+        for k, label in enumerate(uniques):
+            if label in where:
+                b, r = where[label]
+                blocks[b][r] += part[k]
+            else:
+                where[label] = (len(blocks), len(new))
+                new.append(k)
+        blocks.append(part[new])
+    labels = pd.Index(list(where))
+    if not blocks:
+        return labels, cols, np.zeros((0, len(cols)), dtype=np.int64)
+    values = np.concatenate(blocks)
+    del blocks
+    if labels.is_monotonic_increasing:
+        return labels, cols, values
+    order = labels.argsort()
+    return labels[order], cols, values[order]
+
+
+class Panel:
+
+    def __init__(self, entities, dates, confirmed, deaths):
+        self.entities = pd.Index(entities)
+        self.dates = pd.DatetimeIndex(dates)
+        self.confirmed = confirmed
+        self.deaths = deaths
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __repr__(self):
+        span = f'{self.dates[0]:%Y-%m-%d}..{self.dates[-1]:%Y-%m-%d}' \
+            if len(self.dates) else 'no dates'
+        return f'<Panel {len(self.entities)} entities x ' \
+               f'{len(self.dates)} days ({span}), {self.confirmed.dtype}>'
+
+    @classmethod
+    def from_wide(cls, confirmed, deaths, key, dtype=np.int64):
+        """Sum the wide confirmed/deaths frames by ``key`` into a panel."""
+        cols = date_columns(confirmed)
+        c = confirmed.groupby(key)[cols].sum()
+        d = deaths.groupby(key)[cols].sum().reindex(c.index, fill_value=0)
+        return cls(c.index, pd.to_datetime(cols, format='%m/%d/%y'),
+                   np.ascontiguousarray(c.values, dtype=dtype),
+                   np.ascontiguousarray(d.values, dtype=dtype))
+
+    @classmethod
+    def from_chunks(cls, confirmed, deaths, key, dtype=np.int64):
+        """Like ``from_wide`` over iterables of wide row chunks.
+
+        Each chunk is summed by ``key`` as it arrives, so only one chunk
+        and the running totals are held. ``key`` is a column name or a
+        function of a chunk returning the labels of the rows to keep.
+        """
+        entities, cols, c = _sum_chunks(confirmed, key)
+        c = c.astype(dtype)
+        labels, day_cols, d = _sum_chunks(deaths, key)
+        # deaths of entities or days missing from the deaths file are 0
+        rows = labels.get_indexer(entities)
+        days = pd.Index(day_cols).get_indexer(cols)
+        deaths = np.zeros(c.shape, dtype=dtype)
+        deaths[np.ix_(rows >= 0, days >= 0)] = \
+            d[np.ix_(rows[rows >= 0], days[days >= 0])]
+        return cls(entities, pd.to_datetime(cols, format='%m/%d/%y'),
+                   c, deaths)
+
+    def between(self, start=None, stop=None):
+        """Panel view of the days from ``start`` to ``stop`` inclusive."""
+        i = 0 if start is None else self.dates.searchsorted(
+            pd.Timestamp(start), 'left')
+        j = len(self.dates) if stop is None else self.dates.searchsorted(
+            pd.Timestamp(stop), 'right')
+        return Panel(self.entities, self.dates[i:j],
+                     self.confirmed[:, i:j], self.deaths[:, i:j])
+
+    def rows(self, start, stop=None):
+        """Panel view of the contiguous entities ``start`` to ``stop``."""
+        i, j = self.entities.slice_locs(start, stop)
+        return Panel(self.entities[i:j], self.dates,
+                     self.confirmed[i:j], self.deaths[i:j])
+
+    def entity(self, name):
+        """(confirmed, deaths) day vectors of one entity, as views."""
+        i = self.entities.get_loc(name)
+        return self.confirmed[i], self.deaths[i]
+
+    def take(self, names):
+        """Panel of an arbitrary list of entities (copies the rows)."""
+        idx = self.entities.get_indexer(names)
+        if (idx < 0).any():
+            raise KeyError(f'Unknown entities: {list(np.asarray(names)[idx < 0])}')
+        return Panel(self.entities[idx], self.dates,
+                     self.confirmed[idx], self.deaths[idx])
+
+    def frame(self, name='confirmed'):
+        """Entity x date DataFrame over one of the matrices."""
+        return pd.DataFrame(getattr(self, name), index=self.entities,
+                            columns=self.dates, copy=False)
+
+    def to_long(self, key, date='Date', values=('Confirmed', 'Deaths'),
+                date_format='%Y-%m-%d'):
+        """Long frame ordered by date then entity, as ``unstack`` gives.
+
+        With ``date_format=None`` the date column stays datetime64.
+        """
+        n, t = self.confirmed.shape
+        dates = self.dates if date_format is None \
+            else self.dates.strftime(date_format)
+        return pd.DataFrame({
+            date: np.repeat(np.asarray(dates), n),
+            key: np.tile(np.asarray(self.entities), t),
+            values[0]: self.confirmed.T.ravel(),
+            values[1]: self.deaths.T.ravel(),
+            })
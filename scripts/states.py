@@ -1,14 +1,24 @@
-import pandas as pd
+import argparse
+import copy
 import numpy as np
-import geopandas as gpd
 import matplotlib
+import matplotlib.path as mpath
 import matplotlib.pyplot as plt
 import logging
+import time
 import us
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from matplotlib.animation import FFMpegWriter
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from pathlib import Path
 
+import buildcache
+import geometry
+import instrument
+import jhu
+
 matplotlib.use("Agg")
 plt.rcParams['animation.ffmpeg_path'] = \
     r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
@@ -18,69 +28,102 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(message)s',
                     datefmt='%d-%b-%y %H:%M:%S')
 
-fp_s = r'..\data\gz_2010_us_040_00_5m\gz_2010_us_040_00_5m.shp'
-fp_c = r'..\data\gz_2010_us_050_00_500k\gz_2010_us_050_00_500k.shp'
-
-logging.info(f'Loading state map data ({fp_s})')
-st_map = gpd.read_file(fp_s)
-
-logging.info(f'Loading county map data ({fp_c})')
-map_df = gpd.read_file(fp_c)
-
-logging.info(f'Converting state map to EPSG 2163.')
-st_map = st_map.to_crs(epsg=2163)
-logging.info(f'Converting county map to EPSG 2163.')
-map_df = map_df.to_crs(epsg=2163)
-
-logging.info(f'Converting Alaska to EPSG 3467.')
-st_map[st_map.STATE == '02'] = st_map[st_map.STATE == '02'].to_crs(epsg=3467)
-map_df[map_df.STATE == '02'] = map_df[map_df.STATE == '02'].to_crs(epsg=3467)
-
-logging.info(f'Converting Hawaii to EPSG 4135.')
-st_map[st_map.STATE == '15'] = st_map[st_map.STATE == '15'].to_crs(epsg=4135)
-map_df[map_df.STATE == '15'] = map_df[map_df.STATE == '15'].to_crs(epsg=4135)
-
-# if not Path('../data/merged3857.pkl').exists():
-us_confirmed_path = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-us_death_path = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
-
-logging.info(f'Loading confirmed cases: {us_confirmed_path}')
-us_c = pd.read_csv(us_confirmed_path)
 
-logging.info(f'Loading death cases: {us_death_path}')
-us_d = pd.read_csv(us_death_path)
-
-map_df['cid'] = map_df.GEO_ID.apply(lambda x: str(x)[-5:])
-us_c['cid'] = us_c.UID.apply(lambda x: str(x)[-5:])
-us_d['cid'] = us_d.UID.apply(lambda x: str(x)[-5:])
-
-c = us_c.groupby('cid').sum().iloc[:, 5:].unstack().reset_index()
-d = us_d.groupby('cid').sum().iloc[:, 6:].unstack().reset_index()
-cd = pd.merge(c, d, on=['level_0', 'cid'])
-new_names = {'level_0': 'date', '0_x': 'confirmed', '0_y': 'deaths'}
-cd = cd.rename(index=str, columns=new_names)
-cd['date'] = pd.to_datetime(cd['date'])
-
-logging.info(f'Merging map data and metric data.')
-merged = pd.merge(map_df, cd, on='cid')
-
-    # merged.to_pickle('../data/merged3857.pkl')
-# else:
-    # merged = pd.read_pickle('../data/merged3857.pkl')
-
-for state in merged.STATE.unique():
+def load(states=None):
+    """Load and project the maps and county counts.
+
+    Returns (st_map, counties, panel): ``counties`` has one row and one
+    geometry per county, indexed by integer FIPS code with a categorical
+    ``STATE``, and ``panel`` holds the int32 county x day counts of the same
+    counties in the same order. ``states`` optionally restricts the result
+    to a list of state FIPS codes.
+
+    The counts used to be melted to a long frame with string keys and
+    merged onto the county shapes, repeating every map column on each of
+    the ~3.3M county-day rows: about 360 MB at peak and 620 MB held for
+    the full history. The panel and shapes hold about 26 MB, and streaming
+    the wide files into the panel peaks at about 75 MB.
+    """
+    with instrument.stage('maps') as s:
+        logging.info('Loading projected state map data.')
+        st_map = geometry.load(geometry.STATE_SHAPES, 2163,
+                               geometry.INSET_EPSG)
+
+        logging.info('Loading projected county map data.')
+        map_df = geometry.load(geometry.COUNTY_SHAPES, 2163,
+                               geometry.INSET_EPSG)
+        s['rows_out'] = len(map_df)
+
+    with instrument.stage('panel') as s:
+        logging.info(f'Loading confirmed cases and deaths by county.')
+        panel = jhu.load_panel('US', jhu.county_fips, ['UID', 'Admin2'],
+                               dtype=np.int32)
+        s['rows_out'] = len(panel)
+
+    counties = map_df.set_index(map_df.fips.astype(int))
+    counties['STATE'] = counties.STATE.astype('category')
+    if states is not None:
+        counties = counties[counties.STATE.isin(states)]
+        st_map = st_map[st_map.STATE.isin(states)]
+
+    logging.info(f'Matching map data and metric data.')
+    cids = counties.index.intersection(panel.entities)
+    return st_map, counties.loc[cids], panel.take(cids)
+
+
+def _patches(geoms):
+    """One path patch per polygon part; ``owner`` maps patches to rows."""
+    patches, owner = list(), list()
+    for i, geom in enumerate(geoms):
+        parts = getattr(geom, 'geoms', [geom])
+        for poly in parts:
+            rings = [poly.exterior] + list(poly.interiors)
+            path = mpath.Path.make_compound_path(
+                *[mpath.Path(np.asarray(r.coords)[:, :2]) for r in rings])
+            patches.append(PathPatch(path))
+            owner.append(i)
+    return patches, np.asarray(owner, dtype=int)
+
+
+def render_state(state, counties, panel, this_st_map):
+    """Render one state's animation from its counties and their panel rows.
+
+    Returns the instrumentation records of this process, so a worker's
+    records reach ``main``.
+    """
+    with instrument.stage(f'render-{state}', rows_in=len(counties)) as s:
+        s['outputs'] = [_render(state, counties, panel, this_st_map)]
+    return instrument.records()
+
+
+def _render(state, counties, panel, this_st_map):
+    """Write the animation of one state; return its path.
+
+    The county polygons are drawn once; each frame only updates the face
+    colors, the color limits and the two text annotations.
+    """
     st_name = us.states.lookup(state).name
-    this_st_map = st_map[st_map.STATE == state]
-
-    df = merged[merged.STATE == state]
-    df = df[df.confirmed > 0]
-    df.sort_values('date', inplace=True)
+    out = f'../figures/{st_name}.mp4'
+
+    # counties and days without any cases yet are left out
+    cases = panel.confirmed > 0
+    rows, days = cases.any(axis=1), cases.any(axis=0)
+    counties = counties[rows]
+    dates = panel.dates[days]
+    confirmed = panel.confirmed[rows][:, days]
+    key = buildcache.key(Path(__file__), counties.index, dates, confirmed,
+                         [g.wkb for g in counties.geometry],
+                         [g.wkb for g in this_st_map.geometry])
+    if buildcache.restore(f'mp4-{state}', key):
+        return out
+
+    values = np.where(confirmed > 0, confirmed, np.nan)
 
     logging.info(f'Creating animation for {st_name}.')
     metadata = dict(title=f'{st_name} COVID-19 Confirmed Cases',
                     artist='Matplotlib',
                     comment='Source: JHU CSSE COVID-19 Dataset')
-    writer = FFMpegWriter(fps=len(df.date.unique()) // 15, metadata=metadata)
+    writer = FFMpegWriter(fps=len(dates) // 15, metadata=metadata)
 
     fig, ax = plt.subplots(1, figsize=(10, 6))
     this_st_map.boundary.plot(linewidth=0.8, ax=ax, edgecolor='0.8')
@@ -88,48 +131,91 @@ for state in merged.STATE.unique():
     ax.set_title(f'{st_name} COVID-19 Confirmed Cases',
                  fontdict={'fontsize': '18', 'fontweight': '3'})
 
+    # counties without cases yet are left unfilled, as before
+    cmap = copy.copy(plt.get_cmap('Blues'))
+    cmap.set_bad('none')
+    patches, owner = _patches(counties.geometry)
+    coll = PatchCollection(patches, cmap=cmap, linewidth=0.8,
+                           edgecolor='0.8')
+    coll.set_array(np.ma.masked_invalid(values[owner, 0]))
+    coll.set_clim(0, np.nanmax(values))
+    ax.add_collection(coll)
+    ax.autoscale_view()
+
     div = make_axes_locatable(ax)
     cax = div.append_axes('bottom', '5%', '5%')
-    # vmin = df.confirmed.min()
-    vmax = df.confirmed.max()
-    sm = plt.cm.ScalarMappable(cmap='Blues', norm=plt.Normalize(vmin=0, vmax=vmax))
-    cbar = fig.colorbar(sm, orientation="horizontal",
-                        fraction=0.036, pad=0.1, aspect=30, cax=cax)
-
-    with writer.saving(fig, f'../figures/{st_name}.mp4', 150):
-        src, cas = None, None
-        for n, date in enumerate(df.date.unique()):
-            cond2 = (df.date == date)
-            this_plot = df[cond2].copy()
-
-            total = this_plot.confirmed.sum()
-
-            str_date = np.datetime_as_string(date, unit='D')
-            if src:
-                src.remove()
-            src = ax.annotate(f'Source: JHU CSSE COVID-19 Dataset, {str_date}',
-                        xy=(0.05, 0.2),
-                        xycoords='figure fraction',
-                        horizontalalignment='left',
-                        verticalalignment='top',
-                        fontsize=8, color='#555555')
-            if cas:
-                cas.remove()
-            cas = ax.annotate(f'Cases: {total:,}',
-                        xy=(0.1, 0.85),
-                        xycoords='figure fraction',
-                        horizontalalignment='left',
-                        verticalalignment='top',
-                        fontsize=10, color='#555555')
-            vmax = this_plot.confirmed.max()
-            sm = plt.cm.ScalarMappable(cmap='Blues',
-                                       norm=plt.Normalize(vmin=0, vmax=vmax))
-            cax.cla()
-            fig.colorbar(sm, orientation="horizontal",
-                                fraction=0.036, pad=0.1, aspect=30, cax=cax)
-
-            this_plot.plot(column='confirmed', cmap='Blues', linewidth=0.8,
-                           ax=ax, edgecolor='0.8')
+    fig.colorbar(coll, orientation="horizontal",
+                 fraction=0.036, pad=0.1, aspect=30, cax=cax)
+
+    src = ax.annotate('', xy=(0.05, 0.2),
+                      xycoords='figure fraction',
+                      horizontalalignment='left',
+                      verticalalignment='top',
+                      fontsize=8, color='#555555')
+    cas = ax.annotate('', xy=(0.1, 0.85),
+                      xycoords='figure fraction',
+                      horizontalalignment='left',
+                      verticalalignment='top',
+                      fontsize=10, color='#555555')
+
+    with writer.saving(fig, out, 150):
+        for n, date in enumerate(dates):
+            day = values[:, n]
+            str_date = np.datetime_as_string(date.to_datetime64(), unit='D')
+            src.set_text(f'Source: JHU CSSE COVID-19 Dataset, {str_date}')
+            cas.set_text(f'Cases: {int(np.nansum(day)):,}')
+
+            coll.set_array(np.ma.masked_invalid(day[owner]))
+            coll.set_clim(0, np.nanmax(day))
             logging.debug(f'Grabbing frame: {n + 1}')
             writer.grab_frame()
-    fig.close()
+    plt.close(fig)
+    buildcache.store(f'mp4-{state}', key, [out])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Render per-state county animations to figures/.')
+    parser.add_argument('--states', nargs='+', metavar='STATE',
+                        help='state names, abbreviations or FIPS codes '
+                             '(default: all)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of render processes (default: 1)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    states = None
+    if args.states:
+        states = list()
+        for s in args.states:
+            st = us.states.lookup(s)
+            if st is None:
+                parser.error(f'unknown state: {s}')
+            states.append(st.fips)
+    st_map, counties, panel = load(states)
+    stages = instrument.records()
+
+    # largest states first so the pool does not wait on one long render
+    jobs = list()
+    for state, n in counties.STATE.value_counts().items():
+        if n:
+            these = counties[counties.STATE == state]
+            jobs.append((state, these, panel.take(these.index),
+                         st_map[st_map.STATE == state]))
+    if args.workers == 1:
+        for job in jobs:
+            stages.extend(render_state(*job))
+    else:
+        with ProcessPoolExecutor(args.workers) as pool:
+            for f in as_completed([pool.submit(render_state, *job)
+                                   for job in jobs]):
+                stages.extend(f.result())
+    if instrument.ENABLED:
+        path = instrument.write_report(
+            stages, 'states', wall=round(time.perf_counter() - start, 3))
+        logging.info(f'Run report written to {path}.')
+
+
+if __name__ == '__main__':
+    main()